@@ -1,25 +1,116 @@
+import argparse
 import asyncio
+import concurrent.futures
+import contextlib
+import csv
+import hashlib
+import json
 import os
+import random
+import re
+import shutil
+import signal
 import socket
+import sqlite3
 import subprocess
 import sys
+import tempfile
 import threading
 import time
-import tkinter as tk
+from array import array
+from collections import deque
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
 from pathlib import Path
-from tkinter import filedialog, messagebox, ttk
+from typing import TYPE_CHECKING
 
-try:
-    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+if TYPE_CHECKING:
+    import tkinter as tk
+
+# Referencia para medir el tiempo hasta la ventana (ver main)
+STARTED_AT = time.perf_counter()
+
+# Playwright, openpyxl y psutil no se importan aqui: tardan (sobre todo en el binario PyInstaller)
+# y retrasarian la ventana. Se cargan al primer uso o con preload_dependencies() en segundo plano.
+PlaywrightTimeoutError: type[Exception] = Exception
+_LAZY_IMPORT_LOCK = threading.Lock()
+_LAZY_IMPORTS: dict[str, object] = {}
+IMPORT_SECONDS: dict[str, float] = {}
+
+def _lazy_import(name: str, importer):
+    """
+    Importa una dependencia pesada una sola vez (thread-safe) y anota cuanto tardo en
+    IMPORT_SECONDS. Devuelve None si no esta instalada.
+    """
+    with _LAZY_IMPORT_LOCK:
+        if name not in _LAZY_IMPORTS:
+            started = time.perf_counter()
+            try:
+                _LAZY_IMPORTS[name] = importer()
+            except ImportError:
+                _LAZY_IMPORTS[name] = None
+            IMPORT_SECONDS[name] = time.perf_counter() - started
+        return _LAZY_IMPORTS[name]
+
+
+def _import_playwright():
+    global PlaywrightTimeoutError
+    from playwright.async_api import TimeoutError as playwright_timeout_error
     from playwright.async_api import async_playwright
-except ImportError:  # Playwright no instalado
-    async_playwright = None  # type: ignore[assignment]
-    PlaywrightTimeoutError = Exception  # type: ignore[assignment]
 
-try:
+    PlaywrightTimeoutError = playwright_timeout_error
+    return async_playwright
+
+
+def _import_openpyxl():
     from openpyxl import load_workbook
-except ImportError:  # openpyxl no instalado
-    load_workbook = None  # type: ignore[assignment]
+
+    return load_workbook
+
+
+def _import_psutil():
+    import psutil
+
+    return psutil
+
+
+def get_async_playwright():
+    """
+    async_playwright de Playwright (importado al primer uso), o None si no esta instalado.
+    """
+    return _lazy_import("playwright", _import_playwright)
+
+
+def get_load_workbook():
+    """
+    load_workbook de openpyxl (importado al primer uso), o None si no esta instalado.
+    """
+    return _lazy_import("openpyxl", _import_openpyxl)
+
+
+def get_psutil():
+    """
+    Modulo psutil (importado al primer uso), o None si no esta instalado: el RSS se lee de
+    /proc (Linux) o se omite.
+    """
+    return _lazy_import("psutil", _import_psutil)
+
+
+def preload_dependencies() -> threading.Thread:
+    """
+    Importa Playwright y openpyxl en un hilo de fondo, para que la GUI no espere por ellos
+    ni al abrir ni al primer "Procesar Excel".
+    """
+
+    def runner() -> None:
+        get_async_playwright()
+        get_load_workbook()
+        loaded = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in IMPORT_SECONDS.items())
+        print(f"[inicio] Dependencias cargadas en segundo plano ({loaded}).")
+
+    thread = threading.Thread(target=runner, name="preload-dependencies", daemon=True)
+    thread.start()
+    return thread
 
 
 LISTING_URL = "https://www.mercadolibre.cl/ventas/omni/listado"
@@ -36,9 +127,99 @@ def _base_dir() -> Path:
 BASE_DIR = _base_dir()
 AUTOMATION_PROFILE_DIR = BASE_DIR / "ml_profile"
 
+# Cache local de montos ya resueltos (codigo de venta -> Envíos)
+CACHE_DB_PATH = BASE_DIR / "ml_cache.sqlite3"
+DEFAULT_CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+# Pestañas simultaneas para el paso de MercadoLibre (mismo contexto CDP)
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+
+# Motores para leer el detalle: "page" renderiza una pestaña; "http" pide el HTML con las
+# cookies del contexto y vuelve a "page" si no encuentra el subtotal.
+FETCH_ENGINES = ("page", "http")
+DEFAULT_FETCH_ENGINE = "page"
+AMOUNT_TITLES = ("Envíos", "Bonificaciones")
+
+# Pestañas tibias: cada worker reutiliza su pestaña y la renueva cada N codigos
+DEFAULT_TAB_MAX_USES = 50
+
+# Reintentos con backoff exponencial (con jitter) y limite adaptativo de concurrencia (AIMD)
+DEFAULT_MAX_RETRIES = 2
+RETRY_BASE_DELAY_SECONDS = 1.0
+RETRY_MAX_DELAY_SECONDS = 20.0
+AIMD_FAST_SECONDS = 4.0
+AIMD_DECREASE_COOLDOWN_SECONDS = 3.0
+
+# Lectura en bloque del listado omni antes de ir al detalle de cada venta
+DEFAULT_LISTING_MAX_PAGES = 50
+LISTING_PAGE_PARAM = "page"
+LISTING_ID_KEYS = ("id", "orderId", "order_id", "packId", "pack_id", "saleId", "sale_id")
+
+# Shards: copias del perfil del login, un Chrome por copia en su propio puerto CDP
+SHARD_PROFILES_DIR = BASE_DIR / "ml_shards"
+PROFILE_CLONE_IGNORE = ("Singleton*", "*.lock", "Cache", "Code Cache", "GPUCache", "Service Worker", "Crashpad")
+SHARD_STOP_TIMEOUT_SECONDS = 5.0
+
+# Sesion: chequeo previo (redireccion a login o captcha) y corte tras K fallos seguidos
+LOGIN_URL_MARKERS = ("login", "/jms/")
+# Un desafio se reconoce por la URL final o por su contenedor en una pagina sin el listado;
+# un script o widget de reCAPTCHA dentro del listado normal no cuenta.
+CAPTCHA_URL_MARKERS = ("captcha", "/challenge")
+CAPTCHA_CONTAINER_MARKERS = ('id="px-captcha"', 'class="g-recaptcha"', 'class="h-captcha"', "captcha-challenge")
+SESSION_PROBE_TIMEOUT_MS = 15000
+DEFAULT_BREAKER_THRESHOLD = 5
+# Errores de Playwright cuando Chrome se cerro o se corto la conexion CDP
+CONNECTION_ERROR_MARKERS = ("has been closed", "target closed", "connection closed", "browser closed")
+# Estados de RowTrace que cuentan para el corte (sesion vencida o Chrome caido)
+BREAKER_STATUSES = ("timeout", "login", "closed")
+
+# Vigilancia de memoria de Chrome durante corridas largas
+MEMORY_SAMPLE_SECONDS = 5.0
+DEFAULT_MEMORY_LIMIT_MB = 3072
+DEFAULT_TAB_HEAP_LIMIT_MB = 512
+MEMORY_RECYCLE_COOLDOWN_SECONDS = 60.0
+
+# Tras el login se conecta BrowserService en segundo plano (Playwright + CDP) para que el
+# primer "Procesar Excel" no pague ese costo
+PREWARM_AFTER_LOGIN = True
+
+# Avance: la GUI lo refresca cada N ms y la consola lo imprime cada N segundos
+PROGRESS_REFRESH_MS = 250
+PROGRESS_LOG_SECONDS = 5.0
+PROGRESS_RATE_WINDOW_SECONDS = 10.0
+
+# Bloqueo opcional de recursos en las paginas de detalle (solo se lee un subtotal)
+BLOCKED_RESOURCE_TYPES = ("image", "media", "font", "stylesheet")
+BLOCKED_URL_PATTERNS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "facebook.net",
+    "hotjar.com",
+    "melidata",
+    "/tracks",
+)
+ALLOWED_URL_PATTERNS: tuple[str, ...] = ()
+FIRST_PARTY_HOSTS = ("mercadolibre.cl", "mercadolibre.com", "mlstatic.com", "mercadopago.com")
+# Tamaño aproximado por tipo; un request abortado no informa su tamaño real.
+ESTIMATED_RESOURCE_BYTES = {
+    "image": 40_000,
+    "media": 200_000,
+    "font": 50_000,
+    "stylesheet": 30_000,
+    "script": 60_000,
+}
+
 # Para apertura manual del listado con tu Chrome normal
 DEFAULT_PROFILE_NAME = "Default"
-DEFAULT_USER_DATA_DIR = Path(os.path.expandvars(r"%LocalAppData%\Google\Chrome\User Data"))
+if sys.platform == "win32":
+    DEFAULT_USER_DATA_DIR = Path(os.path.expandvars(r"%LocalAppData%\Google\Chrome\User Data"))
+else:
+    DEFAULT_USER_DATA_DIR = Path.home() / ".config" / "google-chrome"
+
+# Binarios que se buscan en el PATH fuera de Windows (servidor Linux de lotes)
+LINUX_CHROME_NAMES = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser")
 
 REMOTE_DEBUG_PORT: int | None = None
 CHROME_PROCESS: subprocess.Popen | None = None
@@ -46,13 +227,21 @@ CHROME_PROCESS: subprocess.Popen | None = None
 
 def find_chrome_executable() -> str | None:
     """
-    Busca chrome.exe en rutas habituales de Windows.
+    Busca Chrome: la ruta de CHROME_PATH si esta definida, chrome.exe en rutas habituales de
+    Windows y, en Linux, Chrome/Chromium en el PATH o en sus rutas de instalacion tipicas.
     """
-    candidates = [
-        r"C:\Program Files\Google\Chrome\Application\chrome.exe",
-        r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
-        os.path.expandvars(r"%LocalAppData%\Google\Chrome\Application\chrome.exe"),
-    ]
+    override = os.environ.get("CHROME_PATH")
+    if override and os.path.isfile(override):
+        return override
+    if sys.platform == "win32":
+        candidates = [
+            r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+            r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
+            os.path.expandvars(r"%LocalAppData%\Google\Chrome\Application\chrome.exe"),
+        ]
+    else:
+        candidates = [shutil.which(name) or "" for name in LINUX_CHROME_NAMES]
+        candidates += ["/opt/google/chrome/chrome", "/usr/bin/chromium", "/snap/bin/chromium"]
     for path in candidates:
         if os.path.isfile(path):
             return path
@@ -73,6 +262,8 @@ def build_chrome_command(chrome_exe: str, url: str) -> list[str]:
 
 
 def open_with_url(url: str) -> None:
+    from tkinter import messagebox
+
     chrome_exe = find_chrome_executable()
     if not chrome_exe:
         messagebox.showerror(
@@ -96,12 +287,19 @@ def open_listing() -> None:
     open_with_url(LISTING_URL)
 
 
-def open_login() -> None:
+def open_login(prewarm: bool = PREWARM_AFTER_LOGIN) -> None:
     print("[login] Abriendo ventana para iniciar sesion con perfil ml_profile...")
-    threading.Thread(target=start_login_browser, daemon=True).start()
+
+    def runner() -> None:
+        if start_login_browser() and prewarm:
+            prewarm_browser_service()
+
+    threading.Thread(target=runner, daemon=True).start()
 
 
 def open_detail(code: str) -> None:
+    from tkinter import messagebox
+
     clean_code = code.strip()
     if not clean_code:
         messagebox.showwarning("Codigo requerido", "Ingresa un codigo de venta.")
@@ -110,10 +308,7 @@ def open_detail(code: str) -> None:
     url = DETAIL_URL_TEMPLATE.format(code=clean_code)
     print(f"[{clean_code}] Abriendo detalle y extrayendo Envíos...")
 
-    threading.Thread(
-        target=lambda: asyncio.run(open_detail_and_extract(clean_code, url)),
-        daemon=True,
-    ).start()
+    get_browser_service().submit(open_detail_and_extract(clean_code, url))
 
 
 def select_and_process_excel(
@@ -121,31 +316,78 @@ def select_and_process_excel(
     on_status=None,
     on_finish=None,
     cancel_event: threading.Event | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    force_refresh: bool = False,
+    block_resources: bool = False,
+    engine: str = DEFAULT_FETCH_ENGINE,
+    progress: "ProgressState | None" = None,
+    listing_harvest: bool = False,
+    headless: bool = False,
+    session_check: bool = True,
 ) -> None:
-    file_path = filedialog.askopenfilename(
-        title="Seleccionar Excel",
+    from tkinter import filedialog
+
+    file_paths = filedialog.askopenfilenames(
+        title="Seleccionar Excel (uno o varios)",
         filetypes=[("Excel", "*.xlsx"), ("Todos los archivos", "*.*")],
     )
-    if not file_path:
+    if not file_paths:
         if on_finish:
             on_finish(cancelled=False, started=False)
         return
 
+    file_paths = list(file_paths)
     if on_status:
-        on_status(f"Procesando: {Path(file_path).name}")
-    print(f"[excel] Archivo seleccionado: {file_path}")
+        if len(file_paths) == 1:
+            on_status(f"Procesando: {Path(file_paths[0]).name}")
+        else:
+            on_status(f"Procesando lote de {len(file_paths)} archivos...")
+    print(f"[excel] Archivo(s) seleccionado(s): {', '.join(file_paths)}")
+
+    options = {
+        "concurrency": concurrency,
+        "force_refresh": force_refresh,
+        "block_resources": block_resources,
+        "engine": engine,
+        "progress": progress,
+        "listing_harvest": listing_harvest,
+        "session_check": session_check,
+    }
+
+    async def job() -> bool:
+        # Corre en el loop de BrowserService para reutilizar su conexion a Chrome.
+        service = get_browser_service()
+        connect_started = time.perf_counter()
+        try:
+            context = await (service.get_managed_context() if headless else service.get_context())
+        except Exception as exc:
+            print(f"[excel] {exc}")
+            if on_status:
+                on_status(str(exc))
+            return False
+        print(f"[excel] Contexto de Chrome listo en {time.perf_counter() - connect_started:.2f}s.")
+        if len(file_paths) == 1:
+            return await process_excel(
+                file_paths[0],
+                on_progress=on_progress,
+                on_status=on_status,
+                cancel_event=cancel_event,
+                context=context,
+                **options,
+            )
+        return await process_batch(
+            file_paths,
+            on_progress=on_progress,
+            on_status=on_status,
+            cancel_event=cancel_event,
+            context=context,
+            **options,
+        )
 
     def runner() -> None:
         cancelled = False
         try:
-            cancelled = asyncio.run(
-                process_excel(
-                    file_path,
-                    on_progress=on_progress,
-                    on_status=on_status,
-                    cancel_event=cancel_event,
-                )
-            )
+            cancelled = get_browser_service().submit(job()).result()
         except Exception as exc:  # pragma: no cover - log unexpected thread error
             print(f"[excel] Error no controlado: {exc}")
             if on_status:
@@ -157,7 +399,7 @@ def select_and_process_excel(
     threading.Thread(target=runner, daemon=True).start()
 
 
-def center_window(win: tk.Tk, width: int = 520, height: int = 380) -> None:
+def center_window(win: "tk.Tk", width: int = 520, height: int = 488) -> None:
     win.update_idletasks()
     screen_width = win.winfo_screenwidth()
     screen_height = win.winfo_screenheight()
@@ -167,6 +409,10 @@ def center_window(win: tk.Tk, width: int = 520, height: int = 380) -> None:
 
 
 def main() -> None:
+    # tkinter se importa aqui para que el modo consola (run_cli) funcione sin GUI.
+    import tkinter as tk
+    from tkinter import ttk
+
     root = tk.Tk()
     root.title("Despachos ML")
     root.resizable(False, False)
@@ -206,6 +452,92 @@ def main() -> None:
     )
     login_button.pack(pady=(0, 14))
 
+    options_frame = tk.Frame(root, bg="#f2f2f2")
+    options_frame.pack(pady=(0, 4))
+
+    concurrency_var = tk.IntVar(value=DEFAULT_CONCURRENCY)
+    tk.Label(
+        options_frame,
+        text="Pestañas en paralelo:",
+        font=("Segoe UI", 9),
+        bg="#f2f2f2",
+    ).pack(side="left", padx=(0, 6))
+    tk.Spinbox(
+        options_frame,
+        from_=1,
+        to=MAX_CONCURRENCY,
+        width=4,
+        textvariable=concurrency_var,
+        font=("Segoe UI", 9),
+    ).pack(side="left")
+
+    listing_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        options_frame,
+        text="Leer listado primero",
+        variable=listing_var,
+        font=("Segoe UI", 9),
+        bg="#f2f2f2",
+        activebackground="#f2f2f2",
+    ).pack(side="left", padx=(12, 0))
+
+    headless_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        options_frame,
+        text="Sin ventana",
+        variable=headless_var,
+        font=("Segoe UI", 9),
+        bg="#f2f2f2",
+        activebackground="#f2f2f2",
+    ).pack(side="left", padx=(12, 0))
+
+    flags_frame = tk.Frame(root, bg="#f2f2f2")
+    flags_frame.pack(pady=(0, 4))
+
+    force_refresh_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        flags_frame,
+        text="Ignorar cache",
+        variable=force_refresh_var,
+        font=("Segoe UI", 9),
+        bg="#f2f2f2",
+        activebackground="#f2f2f2",
+    ).pack(side="left")
+
+    block_resources_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        flags_frame,
+        text="Bloquear imagenes/analitica",
+        variable=block_resources_var,
+        font=("Segoe UI", 9),
+        bg="#f2f2f2",
+        activebackground="#f2f2f2",
+    ).pack(side="left", padx=(12, 0))
+
+    http_engine_var = tk.BooleanVar(value=DEFAULT_FETCH_ENGINE == "http")
+    tk.Checkbutton(
+        flags_frame,
+        text="Modo rapido (HTTP)",
+        variable=http_engine_var,
+        font=("Segoe UI", 9),
+        bg="#f2f2f2",
+        activebackground="#f2f2f2",
+    ).pack(side="left", padx=(12, 0))
+
+    checks_frame = tk.Frame(root, bg="#f2f2f2")
+    checks_frame.pack(pady=(0, 4))
+
+    # Si el chequeo previo da un falso positivo (sesion ok pero marcada como vencida), se apaga aqui.
+    session_check_var = tk.BooleanVar(value=True)
+    tk.Checkbutton(
+        checks_frame,
+        text="Verificar sesion antes de empezar",
+        variable=session_check_var,
+        font=("Segoe UI", 9),
+        bg="#f2f2f2",
+        activebackground="#f2f2f2",
+    ).pack(side="left")
+
     progress_var = tk.StringVar(value="Progreso: 0/0")
     status_var = tk.StringVar(value="Listo para procesar.")
 
@@ -227,7 +559,18 @@ def main() -> None:
         mode="determinate",
         length=360,
     )
-    progress_bar.pack(fill="x", padx=12, pady=(2, 6))
+    progress_bar.pack(fill="x", padx=12, pady=(2, 2))
+
+    stats_var = tk.StringVar(value="")
+    stats_label = tk.Label(
+        progress_frame,
+        textvariable=stats_var,
+        font=("Segoe UI", 8),
+        fg="#555",
+        bg="#f2f2f2",
+        anchor="w",
+    )
+    stats_label.pack(anchor="w", padx=12, pady=(0, 4))
 
     status_label = tk.Label(
         progress_frame,
@@ -252,25 +595,37 @@ def main() -> None:
             process_button.config(state=tk.NORMAL)
             cancel_button.config(state=tk.DISABLED)
 
-    def update_progress(processed: int, total: int) -> None:
-        def _update() -> None:
-            total_for_bar = max(total, 1)
-            progress_bar.config(maximum=total_for_bar)
+    # Los workers solo tocan este estado; refresh_progress lo vuelca a la ventana.
+    progress = ProgressState()
+    update_progress = progress.set_progress
+    update_status = progress.set_status
+    shown_version = -1
+
+    def refresh_progress() -> None:
+        nonlocal shown_version
+        snapshot = progress.snapshot()
+        if snapshot["version"] != shown_version:
+            shown_version = snapshot["version"]
+            processed, total = snapshot["processed"], snapshot["total"]
+            progress_bar.config(maximum=max(total, 1))
             progress_bar["value"] = processed
             progress_var.set(f"Progreso: {processed}/{total}")
+            if snapshot["status"]:
+                status_var.set(snapshot["status"])
+            stats_var.set(ProgressState.describe(snapshot) if total else "")
 
-        root.after(0, _update)
-
-    def update_status(text: str) -> None:
-        root.after(0, lambda: status_var.set(text))
+    def poll_progress() -> None:
+        refresh_progress()
+        root.after(PROGRESS_REFRESH_MS, poll_progress)
 
     def finish_processing(cancelled: bool, started: bool = True) -> None:
         def _finish() -> None:
+            refresh_progress()
             set_processing_state(False)
             if not started:
-                progress_var.set("Progreso: 0/0")
-                progress_bar["value"] = 0
-                status_var.set("Listo para procesar.")
+                progress.reset()
+                progress.set_status("Listo para procesar.")
+                refresh_progress()
                 return
             if cancelled and not status_var.get():
                 status_var.set("Proceso cancelado.")
@@ -283,10 +638,18 @@ def main() -> None:
             current_cancel_event.set()
             update_status("Cancelando proceso...")
 
+    def read_concurrency() -> int:
+        try:
+            value = int(concurrency_var.get())
+        except (tk.TclError, ValueError):
+            value = DEFAULT_CONCURRENCY
+        return max(1, min(value, MAX_CONCURRENCY))
+
     def start_excel_processing() -> None:
         nonlocal current_cancel_event
         current_cancel_event = threading.Event()
         set_processing_state(True)
+        progress.reset()
         update_progress(0, 0)
         update_status("Selecciona un archivo de Excel...")
         select_and_process_excel(
@@ -294,6 +657,14 @@ def main() -> None:
             on_status=update_status,
             on_finish=finish_processing,
             cancel_event=current_cancel_event,
+            concurrency=read_concurrency(),
+            force_refresh=force_refresh_var.get(),
+            block_resources=block_resources_var.get(),
+            engine="http" if http_engine_var.get() else "page",
+            progress=progress,
+            listing_harvest=listing_var.get(),
+            headless=headless_var.get(),
+            session_check=session_check_var.get(),
         )
 
     process_button = tk.Button(
@@ -329,74 +700,56 @@ def main() -> None:
     )
     cancel_button.pack(pady=(0, 12))
 
+    def on_window_ready() -> None:
+        print(f"[inicio] Ventana lista en {time.perf_counter() - STARTED_AT:.2f}s.")
+        preload_dependencies()
+
+    poll_progress()
+    root.after_idle(on_window_ready)
     root.mainloop()
 
 
 async def open_detail_and_extract(code: str, url: str) -> None:
     """
-    Se conecta al Chrome abierto con el boton de login (puerto CDP) y lee el valor de Envíos.
-    Se crea una instancia nueva de Playwright por llamada para evitar conexiones rotas.
+    Lee el valor de Envíos usando la conexion persistente de BrowserService al Chrome abierto
+    con el boton de login. Debe correr en el loop del servicio (ver open_detail).
     """
-    if async_playwright is None:
+    if await asyncio.to_thread(get_async_playwright) is None:
         print(
             f"[{code}] Playwright no esta instalado. Ejecuta: pip install playwright && python -m playwright install"
         )
         return
 
-    if REMOTE_DEBUG_PORT is None:
-        print(f"[{code}] No hay puerto de depuracion. Pulsa primero el boton de login.")
+    try:
+        context = await get_browser_service().get_context()
+    except Exception as exc:
+        print(f"[{code}] Error conectando a Chrome: {exc}")
         return
 
-    if not wait_for_port("localhost", REMOTE_DEBUG_PORT, attempts=10, delay=0.4):
-        print(f"[{code}] No se pudo alcanzar el puerto {REMOTE_DEBUG_PORT}.")
+    try:
+        page = await context.new_page()
+    except Exception as exc:
+        print(f"[{code}] No se pudo abrir una nueva pestaña: {exc}")
         return
 
-    endpoint = f"http://localhost:{REMOTE_DEBUG_PORT}"
-    playwright = await async_playwright().start()
     try:
-        browser = await playwright.chromium.connect_over_cdp(endpoint)
-        if not browser.contexts:
-            print(f"[{code}] No hay contextos en Chrome. ¿Cerraste la ventana de login?")
-            return
-
-        context = browser.contexts[0]
-        try:
-            page = await context.new_page()
-        except Exception as exc:
-            print(f"[{code}] No se pudo abrir una nueva pestaña: {exc}")
-            return
-
         page.set_default_timeout(20000)
         await page.goto(url, wait_until="domcontentloaded")
 
-        text = await extract_amount_text(page, "Envíos", timeout_ms=2000, fast_fail=True)
-        source = "Envíos"
-
-        if text is None:
-            # Bonificaciones debería resolverse rápido si no hay Envíos; usa timeout corto
-            text = await extract_amount_text(page, "Bonificaciones", timeout_ms=1000, fast_fail=True)
-            source = "Bonificaciones" if text else None
+        rows = await extract_account_rows(page)
+        parsed, source = pick_shipping_amount(rows)
 
-        if text is None:
+        if source is None:
             print(f"[{code}] No se encontraron Envíos ni Bonificaciones. Valor: $ 0")
             return
 
-        parsed = parse_amount(text)
         if parsed is None:
-            print(f"[{code}] No se pudo interpretar el valor de {source}: {text}")
+            print(f"[{code}] No se pudo interpretar el valor de {source}: {dict(rows)}")
             return
 
-        if parsed < 0:
-            parsed = 0
-
         print(f"[{code}] Envíos ({source}): {format_amount(parsed)}")
     except Exception as exc:
-        print(f"[{code}] Error conectando a Chrome: {exc}")
-    finally:
-        try:
-            await playwright.stop()
-        except Exception:
-            pass
+        print(f"[{code}] Error leyendo el detalle: {exc}")
 
 
 async def process_excel(
@@ -404,15 +757,81 @@ async def process_excel(
     on_progress=None,
     on_status=None,
     cancel_event: threading.Event | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    use_cache: bool = True,
+    cache_ttl: float | None = DEFAULT_CACHE_TTL_SECONDS,
+    force_refresh: bool = False,
+    block_resources: bool = False,
+    engine: str = DEFAULT_FETCH_ENGINE,
+    cdp_endpoint: str | None = None,
+    output_path: str | None = None,
+    on_summary=None,
+    context=None,
+    shared_amounts: dict[str, int] | None = None,
+    timing_format: str | None = None,
+    tab_max_uses: int = DEFAULT_TAB_MAX_USES,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    rate_limit: float | None = None,
+    adaptive_concurrency: bool = False,
+    progress: "ProgressState | None" = None,
+    prefetch: int = 0,
+    listing_harvest: bool = False,
+    listing_max_pages: int = DEFAULT_LISTING_MAX_PAGES,
+    contexts: list | None = None,
+    session_check: bool = True,
+    breaker_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+    memory_watchdog: bool = False,
+    memory_limit_mb: float = DEFAULT_MEMORY_LIMIT_MB,
+    results_format: str | None = None,
 ) -> bool:
+    """
+    Completa Envíos (X) y total (Y) de la hoja Reporte y guarda <archivo>_con_envios.xlsx
+    (u output_path). Devuelve True si se cancelo. on_summary recibe un dict con el resumen
+    de la corrida; sin cdp_endpoint se usa el Chrome abierto con el boton de login.
+    Si se entrega context (modo lote) se reutiliza esa conexion en vez de abrir otra, y
+    shared_amounts guarda los codigos ya resueltos en archivos anteriores del lote.
+    Con timing_format ("jsonl" o "csv") se escriben los tiempos por codigo y un resumen
+    junto al archivo de salida. Cada worker reutiliza su pestaña hasta tab_max_uses codigos
+    (0 = pestaña nueva por codigo, como antes). Los codigos fallidos se reintentan hasta
+    max_retries veces con backoff; rate_limit (consultas/s) y adaptive_concurrency (AIMD
+    entre 1 y MAX_CONCURRENCY, partiendo de concurrency) regulan la carga sobre ML.
+    progress (ProgressState) acumula aciertos de cache, fallbacks y fallos por codigo.
+    Con prefetch > 0 cada worker navega los siguientes prefetch codigos mientras lee el
+    actual (prefetch + 1 pestañas por worker) y registra los resultados en orden.
+    Con listing_harvest se leen primero hasta listing_max_pages paginas del listado omni y
+    solo los codigos que no aparecen ahi van al detalle de cada venta.
+    Con contexts (uno por shard de ShardFleet) los workers se reparten entre esos
+    navegadores: concurrency pasa a ser pestañas por navegador.
+    Antes de consultar se verifica la sesion (check_session) y, tras breaker_threshold
+    timeouts, redirecciones a login o errores de Chrome cerrado seguidos (0 = sin corte),
+    la corrida se detiene como si se cancelara, conserva la bitacora y el resumen queda en
+    "relogin_required".
+    Los codigos que siguen fallando tras los reintentos no se escriben como 0: X/Y quedan en
+    blanco, se cuentan en failed_codes/failed_rows y el resumen queda en "incomplete".
+    Con memory_watchdog un MemoryWatchdog renueva pestañas si Chrome pasa memory_limit_mb
+    y deja la linea de tiempo de memoria en <salida>.memory.jsonl.
+    Con results_format ("jsonl" o "csv") cada fila resuelta se agrega a <salida>.results.*
+    apenas termina (fila, codigo, canal, monto, fuente, estado, latencia).
+    El resumen incluye first_row_seconds: tiempo desde la llamada hasta la primera fila.
+    """
+    started_at = time.perf_counter()
+    if contexts:
+        context = contexts[0]
+
     def notify_status(message: str) -> None:
         if on_status:
             on_status(message)
 
+    def notify_summary(summary: dict) -> None:
+        if on_summary:
+            on_summary(summary)
+
     def notify_progress(done: int, total: int) -> None:
         if on_progress:
             on_progress(done, total)
 
+    load_workbook = await asyncio.to_thread(get_load_workbook)
+    async_playwright = await asyncio.to_thread(get_async_playwright)
     if load_workbook is None:
         msg = "[excel] Falta openpyxl. Instala con: pip install openpyxl"
         print(msg)
@@ -423,112 +842,420 @@ async def process_excel(
         print(msg)
         notify_status("Falta Playwright. Instala con: pip install playwright && python -m playwright install")
         return False
-    if REMOTE_DEBUG_PORT is None:
-        print("[excel] No hay puerto de depuracion. Pulsa el boton de login primero.")
-        notify_status("No hay puerto de depuracion. Pulsa el boton de login primero.")
-        return False
-    if not wait_for_port("localhost", REMOTE_DEBUG_PORT, attempts=10, delay=0.4):
-        print(f"[excel] No se pudo alcanzar el puerto {REMOTE_DEBUG_PORT}.")
-        notify_status(f"No se pudo alcanzar el puerto {REMOTE_DEBUG_PORT}.")
-        return False
+    if context is None and cdp_endpoint is None:
+        if REMOTE_DEBUG_PORT is None:
+            print("[excel] No hay puerto de depuracion. Pulsa el boton de login primero.")
+            notify_status("No hay puerto de depuracion. Pulsa el boton de login primero.")
+            return False
+        if not wait_for_port("localhost", REMOTE_DEBUG_PORT, attempts=10, delay=0.4):
+            print(f"[excel] No se pudo alcanzar el puerto {REMOTE_DEBUG_PORT}.")
+            notify_status(f"No se pudo alcanzar el puerto {REMOTE_DEBUG_PORT}.")
+            return False
+        cdp_endpoint = f"http://localhost:{REMOTE_DEBUG_PORT}"
+
+    if output_path:
+        output_file = Path(output_path)
+    else:
+        out_path = Path(file_path)
+        output_file = out_path.with_name(f"{out_path.stem}_con_envios{out_path.suffix}")
 
     notify_status("Abriendo Excel...")
+    phase_started = time.perf_counter()
+    # Lo que toca el Excel completo (lectura, hash de la bitacora, escritura y guardado) corre
+    # en hilos: en la GUI este loop es el de BrowserService y no debe quedar bloqueado.
     try:
-        wb = load_workbook(file_path)
+        report = await asyncio.to_thread(scan_report, file_path)
+    except ReportError as exc:
+        print(f"[excel] {exc}")
+        notify_status(str(exc))
+        return False
     except Exception as exc:
         print(f"[excel] No se pudo abrir el archivo: {exc}")
         notify_status(f"No se pudo abrir el archivo: {exc}")
         return False
 
-    if "Reporte" not in wb.sheetnames:
-        print("[excel] No se encontro la hoja 'Reporte'.")
-        notify_status("No se encontro la hoja 'Reporte' en el Excel.")
-        return False
-
-    ws = wb["Reporte"]
-    max_row = ws.max_row
-
-    last_data_col = 0
-    for row in ws.iter_rows():
-        for cell in row:
-            value = cell.value
-            if value is None:
-                continue
-            if isinstance(value, str) and not value.strip():
-                continue
-            if cell.column > last_data_col:
-                last_data_col = cell.column
-
-    if last_data_col < 3:
-        notify_status("No se pudo detectar la ultima columna con datos.")
-        print("[excel] No se pudo detectar la ultima columna con datos.")
-        return False
+    x_col = report.x_col
+    y_col = report.y_col
+    ml_groups = report.ml_groups
+    walmart_groups = report.walmart_groups
 
-    w_col = last_data_col - 2
-    x_col = last_data_col - 1
-    y_col = last_data_col
-
-    rows_to_process: list[tuple[int, str]] = []
-    walmart_groups: dict[str, list[int]] = {}
-    for row_idx in range(2, max_row + 1):
-        channel = ws.cell(row=row_idx, column=6).value  # F
-        sale_code = ws.cell(row=row_idx, column=8).value  # H
-        channel_norm = str(channel).strip().lower()
-        if channel_norm == "mercadolibre":
-            if not sale_code:
-                continue
-            rows_to_process.append((row_idx, sale_code))
-        elif channel_norm == "walmart":
-            if not sale_code:
-                continue
-            code_key = str(sale_code).strip()
-            if not code_key:
-                continue
-            walmart_groups.setdefault(code_key, []).append(row_idx)
+    # La carga completa (necesaria para guardar) corre en un hilo mientras se consulta ML.
+    workbook_task = asyncio.ensure_future(asyncio.to_thread(load_workbook, file_path))
 
-    total_rows = len(rows_to_process)
+    total_rows = sum(len(rows) for rows in ml_groups.values())
+    saved_fetches = total_rows - len(ml_groups)
     notify_progress(0, total_rows)
     if total_rows == 0:
         notify_status("No hay filas de MercadoLibre para procesar.")
         print("[excel] No hay filas de MercadoLibre para procesar.")
 
-    endpoint = f"http://localhost:{REMOTE_DEBUG_PORT}"
-    playwright = await async_playwright().start()
+    journal: RunJournal | None = None
+    if total_rows > 0:
+        try:
+            journal = await asyncio.to_thread(RunJournal, file_path)
+        except Exception as exc:
+            print(f"[excel] No se pudo abrir la bitacora de avance: {exc}")
+
+    cache: AmountCache | None = None
+    if use_cache and total_rows > 0:
+        try:
+            cache = AmountCache(CACHE_DB_PATH, ttl_seconds=cache_ttl)
+        except Exception as exc:
+            print(f"[excel] No se pudo abrir la cache local, se sigue sin cache: {exc}")
+
+    timing: TimingRecorder | None = None
+    if timing_format:
+        try:
+            timing = TimingRecorder(output_file.with_name(f"{output_file.stem}.timing.{timing_format}"))
+            timing.add_run_phase("scan", phase_started)
+        except Exception as exc:
+            print(f"[excel] No se pudo abrir el archivo de tiempos: {exc}")
+
+    results: ResultsSink | None = None
+    if results_format:
+        try:
+            results = ResultsSink(output_file.with_name(f"{output_file.stem}.results.{results_format}"))
+        except Exception as exc:
+            print(f"[excel] No se pudo abrir el archivo de resultados: {exc}")
+
+    playwright = None
     processed_ml = 0
     processed_walmart = 0
     total_walmart_rows = sum(len(rows) for rows in walmart_groups.values())
     cancelled = False
+    blocker: ResourceBlocker | None = None
+    ml_amounts: dict[str, int] = {}
+    shared_hits = 0
+    session_lost = False
+    chrome_lost = False
+    watchdog: MemoryWatchdog | None = None
+    listing_rows = 0
+    listing_codes = 0
+    listing_pages = 0
+    fetch_stats: dict | None = None
+    first_row_seconds: float | None = None
+    # Codigos que siguieron fallando tras los reintentos -> filas; sus X/Y quedan en blanco.
+    failed_codes: dict[str, int] = {}
     try:
-        browser = await playwright.chromium.connect_over_cdp(endpoint)
-        if not browser.contexts:
-            print("[excel] No hay contextos en Chrome. ¿Cerraste la ventana de login?")
-            notify_status("No hay contextos en Chrome. ¿Cerraste la ventana de login?")
-            return False
-        context = browser.contexts[0]
+        if context is None:
+            playwright = await async_playwright().start()
+            browser = await playwright.chromium.connect_over_cdp(cdp_endpoint)
+            if not browser.contexts:
+                print("[excel] No hay contextos en Chrome. ¿Cerraste la ventana de login?")
+                notify_status("No hay contextos en Chrome. ¿Cerraste la ventana de login?")
+                return False
+            context = browser.contexts[0]
+        worker_contexts = contexts or [context]
+
+        if block_resources and total_rows > 0:
+            blocker = ResourceBlocker()
+            try:
+                for worker_context in worker_contexts:
+                    await blocker.install(worker_context)
+            except Exception as exc:
+                print(f"[excel] No se pudo activar el bloqueo de recursos: {exc}")
+                blocker = None
 
         if total_rows > 0:
             notify_status("Procesando MercadoLibre...")
-            for row_idx, sale_code in rows_to_process:
-                if cancel_event and cancel_event.is_set():
-                    cancelled = True
-                    notify_status(f"Proceso cancelado. Guardando archivo... ({processed_ml}/{total_rows})")
-                    break
+            if saved_fetches:
+                print(
+                    f"[excel] {len(ml_groups)} codigos unicos para {total_rows} filas "
+                    f"({saved_fetches} consultas ahorradas)."
+                )
+            resumed = journal.resumed if journal is not None else {}
+            # Cada codigo entra una sola vez a la cola: ningun par de pestañas consulta lo mismo.
+            pending: asyncio.Queue[tuple[str, list[int]]] = asyncio.Queue()
+            for sale_code, row_indices in ml_groups.items():
+                if sale_code in resumed:
+                    ml_amounts[sale_code] = resumed[sale_code]
+                    processed_ml += len(row_indices)
+                    known = "resumed"
+                elif shared_amounts is not None and sale_code in shared_amounts:
+                    ml_amounts[sale_code] = shared_amounts[sale_code]
+                    processed_ml += len(row_indices)
+                    shared_hits += 1
+                    known = "shared"
+                else:
+                    pending.put_nowait((sale_code, row_indices))
+                    continue
+                if results is not None:
+                    for row_idx in row_indices:
+                        results.emit(row_idx, sale_code, "mercadolibre", ml_amounts[sale_code], None, known)
+            if shared_hits:
+                print(f"[excel] {shared_hits} codigos ya resueltos en otros archivos del lote.")
+            if processed_ml:
+                if resumed:
+                    print(f"[excel] Reanudando: {processed_ml}/{total_rows} filas ya resueltas.")
+                    notify_status(f"Reanudando MercadoLibre desde {processed_ml}/{total_rows}...")
+                notify_progress(processed_ml, total_rows)
+
+            tabs_replaced = 0
+            retries = 0
+            recovered = 0
+            throttle: FetchThrottle | None = None
+            browsers = len(worker_contexts)
+            if rate_limit or adaptive_concurrency:
+                throttle = FetchThrottle(
+                    concurrency * browsers,
+                    rate=rate_limit,
+                    adaptive=adaptive_concurrency,
+                    max_limit=MAX_CONCURRENCY * browsers,
+                )
 
+            async def ml_worker(worker_context) -> None:
+                nonlocal tabs_replaced
+                # En modo pipeline cada codigo en vuelo necesita su propia pestaña.
+                tabs = [
+                    WarmTab(worker_context, tab_max_uses) if tab_max_uses > 0 else None for _ in range(prefetch + 1)
+                ]
+                if watchdog is not None:
+                    for tab in tabs:
+                        watchdog.track(tab)
+                try:
+                    if prefetch > 0:
+                        await ml_worker_pipeline(tabs, worker_context)
+                    else:
+                        await ml_worker_loop(tabs[0], worker_context)
+                finally:
+                    for tab in tabs:
+                        if tab is not None:
+                            tabs_replaced += tab.replaced
+                            await tab.close()
+
+            def stopping() -> bool:
+                return session_lost or bool(cancel_event and cancel_event.is_set())
+
+            async def ml_worker_loop(tab: WarmTab | None, worker_context) -> None:
+                nonlocal cancelled
+                while True:
+                    if stopping():
+                        cancelled = True
+                        return
+                    try:
+                        sale_code, row_indices = pending.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    amount, trace = await resolve_code(sale_code, tab, worker_context)
+                    store_result(sale_code, row_indices, amount, trace)
+
+            async def ml_worker_pipeline(tabs: list, worker_context) -> None:
+                """
+                Navega hasta prefetch codigos siguientes mientras se lee el actual; los
+                resultados se registran en el orden en que se tomaron de la cola.
+                """
+                nonlocal cancelled
+                free_tabs = list(tabs)
+                window: deque[tuple[str, list[int], WarmTab | None, asyncio.Future]] = deque()
+                try:
+                    while True:
+                        while free_tabs and not stopping():
+                            try:
+                                sale_code, row_indices = pending.get_nowait()
+                            except asyncio.QueueEmpty:
+                                break
+                            tab = free_tabs.pop()
+                            task = asyncio.ensure_future(resolve_code(sale_code, tab, worker_context))
+                            window.append((sale_code, row_indices, tab, task))
+                        if stopping():
+                            cancelled = True
+                            return
+                        if not window:
+                            return
+                        sale_code, row_indices, tab, task = window.popleft()
+                        amount, trace = await task
+                        free_tabs.append(tab)
+                        store_result(sale_code, row_indices, amount, trace)
+                finally:
+                    # Las navegaciones adelantadas que no alcanzaron a registrarse se descartan;
+                    # una corrida reanudada las vuelve a consultar.
+                    for _, _, _, task in window:
+                        task.cancel()
+                    await asyncio.gather(*(task for _, _, _, task in window), return_exceptions=True)
+
+            async def resolve_code(
+                sale_code: str, tab: WarmTab | None, worker_context
+            ) -> tuple[int | None, RowTrace | None]:
+                nonlocal retries, recovered
                 url = DETAIL_URL_TEMPLATE.format(code=sale_code)
-                amount = await fetch_amount_for_code(context, sale_code, url)
+                # Siempre hay trace: el corte por sesion vencida necesita el estado de cada codigo.
+                trace = timing.new_trace() if timing is not None else RowTrace()
+                attempt = 0
+                with timed_phase(trace, "total"):
+                    while True:
+                        amount = await fetch_amount_for_code(
+                            worker_context,
+                            sale_code,
+                            url,
+                            cache=cache,
+                            force_refresh=force_refresh,
+                            engine=engine,
+                            trace=trace,
+                            tab=tab,
+                            throttle=throttle,
+                        )
+                        if amount is not None:
+                            recovered += attempt > 0
+                            break
+                        if attempt >= max_retries or trace.status == "login" or stopping():
+                            break
+                        if trace.status == "closed" and not context_alive(worker_context):
+                            break  # Chrome desconectado: reintentar solo suma esperas
+                        attempt += 1
+                        retries += 1
+                        delay = retry_delay(attempt)
+                        print(f"[{sale_code}] Reintento {attempt}/{max_retries} en {delay:.1f}s.")
+                        await asyncio.sleep(delay)
+                return amount, trace
+
+            session_streak: list[tuple[str, int]] = []
+
+            def store_result(sale_code: str, row_indices: list[int], amount: int | None, trace) -> None:
+                nonlocal processed_ml, session_lost, chrome_lost, first_row_seconds
+                if timing is not None:
+                    timing.record(sale_code, len(row_indices), amount, trace)
+                if progress is not None:
+                    progress.record_code(trace, amount is None)
+                if amount is None and trace.status in BREAKER_STATUSES:
+                    if session_lost:
+                        return  # ya se corto: no se escriben ceros por la sesion vencida
+                    session_streak.append((sale_code, len(row_indices)))
+                    if breaker_threshold and len(session_streak) >= breaker_threshold:
+                        session_lost = True
+                        # Los codigos de la racha quedan pendientes para que la reanudacion los consulte.
+                        for streak_code, streak_rows in session_streak[:-1]:
+                            failed_codes.pop(streak_code, None)
+                            processed_ml -= streak_rows
+                        notify_progress(processed_ml, total_rows)
+                        chrome_lost = trace.status == "closed"
+                        if chrome_lost:
+                            print(
+                                f"[excel] {len(session_streak)} errores seguidos de Chrome cerrado o sin conexion: "
+                                "se detiene la corrida. Abre Chrome de nuevo con el login y vuelve a procesar."
+                            )
+                            notify_status("Chrome se cerro o perdio la conexion: abrelo con el login (se retoma donde quedo).")
+                        else:
+                            print(
+                                f"[excel] {len(session_streak)} timeouts/redirecciones a login seguidos: "
+                                "se detiene la corrida. Inicia sesion de nuevo y vuelve a procesar."
+                            )
+                            notify_status("Sesion de MercadoLibre vencida: inicia sesion de nuevo (se retoma donde quedo).")
+                        return
+                elif amount is not None:
+                    session_streak.clear()
+                if results is not None:
+                    latency = trace.phases.get("total")
+                    for row_idx in row_indices:
+                        results.emit(row_idx, sale_code, "mercadolibre", amount, trace.source, trace.status, latency)
                 if amount is None:
-                    amount = 0
-
-                ws.cell(row=row_idx, column=x_col).value = amount  # X
+                    # Sin monto no se escribe un 0: la fila queda en blanco y se cuenta como fallida.
+                    # Tampoco se anota en la bitacora: una corrida reanudada la vuelve a intentar.
+                    failed_codes[sale_code] = len(row_indices)
+                    for row_idx in row_indices:
+                        print(f"[excel] Fila {row_idx} ({sale_code}) -> sin dato tras reintentos, queda en blanco")
+                    processed_ml += len(row_indices)
+                    notify_progress(processed_ml, total_rows)
+                    return
+                if shared_amounts is not None:
+                    shared_amounts[sale_code] = amount
+                if journal is not None:
+                    journal.record(sale_code, amount, row_indices)
+
+                ml_amounts[sale_code] = amount
+                if first_row_seconds is None:
+                    first_row_seconds = time.perf_counter() - started_at
+                    print(f"[excel] Primera fila resuelta a los {first_row_seconds:.2f}s.")
+                for row_idx in row_indices:
+                    print(f"[excel] Fila {row_idx} ({sale_code}) -> Envíos: {format_amount(amount)}")
+                processed_ml += len(row_indices)
+                notify_progress(processed_ml, total_rows)
 
-                w_raw = ws.cell(row=row_idx, column=w_col).value  # W
-                w_val = parse_amount(w_raw)
-                w_val = w_val if w_val is not None else 0
-                ws.cell(row=row_idx, column=y_col).value = w_val + amount  # Y
+            if session_check and not pending.empty():
+                notify_status("Verificando sesion de MercadoLibre...")
+                problem = await check_session(context)
+                if problem is not None:
+                    session_lost = True
+                    cancelled = True
+                    print(f"[excel] Sesion no valida ({problem}): no se consulta ningun codigo.")
+                    notify_status("Sesion de MercadoLibre vencida: inicia sesion de nuevo y vuelve a procesar.")
+
+            if listing_harvest and not session_lost and not pending.empty():
+                notify_status("Leyendo el listado de ventas...")
+                queued = [pending.get_nowait() for _ in range(pending.qsize())]
+                wanted = {
+                    sale_code
+                    for sale_code, _ in queued
+                    if cache is None or force_refresh or not cache.contains(sale_code)
+                }
+                phase_started = time.perf_counter()
+                harvested, listing_pages = await harvest_listing(
+                    context, wanted, max_pages=listing_max_pages, cancel_event=cancel_event
+                )
+                if timing is not None:
+                    timing.add_run_phase("listing", phase_started)
+                for sale_code, row_indices in queued:
+                    if sale_code not in harvested:
+                        pending.put_nowait((sale_code, row_indices))
+                        continue
+                    amount, source = harvested[sale_code]
+                    if cache is not None:
+                        cache.put(sale_code, amount, source)
+                    trace = RowTrace()
+                    trace.status, trace.source = "listing", source
+                    trace.fallback = source == "Bonificaciones"
+                    store_result(sale_code, row_indices, amount, trace)
+                    listing_codes += 1
+                    listing_rows += len(row_indices)
+                share = listing_rows / total_rows * 100 if total_rows else 0.0
+                print(
+                    f"[excel] Listado: {listing_codes} codigos ({listing_rows}/{total_rows} filas, "
+                    f"{share:.1f}%) resueltos en {listing_pages} pagina(s); {pending.qsize()} van al detalle."
+                )
 
-                processed_ml += 1
-                notify_progress(processed_ml, total_rows)
-                print(f"[excel] Fila {row_idx} ({sale_code}) -> Envíos: {format_amount(amount)}")
+            if not session_lost:
+                per_browser = MAX_CONCURRENCY if adaptive_concurrency else concurrency
+                workers = max(1, min(per_browser * browsers, pending.qsize()))
+                if browsers > 1:
+                    print(f"[excel] {browsers} navegadores (shards) comparten la cola de codigos.")
+                if adaptive_concurrency:
+                    print(f"[excel] MercadoLibre adaptativo: parte en {concurrency}, hasta {workers} pestaña(s).")
+                else:
+                    print(f"[excel] MercadoLibre con {workers} pestaña(s) en paralelo.")
+                if prefetch > 0:
+                    print(f"[excel] Pipeline: cada worker adelanta {prefetch} codigo(s).")
+                if memory_watchdog:
+                    try:
+                        watchdog = MemoryWatchdog(
+                            context,
+                            output_file.with_name(f"{output_file.stem}.memory.jsonl"),
+                            rss_limit_mb=memory_limit_mb,
+                        )
+                        watchdog.start()
+                    except OSError as exc:
+                        print(f"[excel] No se pudo abrir la linea de tiempo de memoria: {exc}")
+                        watchdog = None
+                # Round-robin: los codigos unicos se reparten entre shards a medida que se liberan.
+                try:
+                    await asyncio.gather(*(ml_worker(worker_contexts[i % browsers]) for i in range(workers)))
+                finally:
+                    if watchdog is not None:
+                        await watchdog.stop()
+            if tabs_replaced:
+                print(f"[excel] Pestañas renovadas (limite de usos, caidas o trabadas): {tabs_replaced}.")
+            fetch_stats = {"retries": retries, "recovered_by_retry": recovered}
+            if throttle is not None:
+                fetch_stats["throttle"] = throttle.stats()
+            if blocker is not None:
+                await blocker.uninstall()
+            if cancelled and not session_lost:
+                notify_status(f"Proceso cancelado. Guardando archivo... ({processed_ml}/{total_rows})")
+
+        columns = report.columns
+        phase_started = time.perf_counter()
+        columns.apply_ml(ml_groups, ml_amounts)
+        if timing is not None:
+            timing.add_run_phase("compute_ml", phase_started)
+            phase_started = time.perf_counter()
 
         if not cancelled and total_walmart_rows > 0:
             notify_progress(0, total_walmart_rows)
@@ -540,44 +1267,50 @@ async def process_excel(
                         f"Proceso cancelado. Guardando archivo... ({processed_walmart}/{total_walmart_rows})"
                     )
                     break
-
-                prices: list[int] = []
-                totals: list[int] = []
-                for row_idx in row_indices:
-                    price_val = parse_amount(ws.cell(row=row_idx, column=w_col).value)
-                    total_val = parse_amount(ws.cell(row=row_idx, column=y_col).value)
-                    prices.append(price_val if price_val is not None else 0)
-                    totals.append(total_val if total_val is not None else 0)
-
-                sum_prices = sum(prices)
-                group_total = max(totals) if totals else 0
-                diff = group_total - sum_prices
-                if diff < 0:
-                    diff = 0
-
-                first_row = row_indices[0]
-                for row_idx in row_indices:
-                    if cancel_event and cancel_event.is_set():
-                        cancelled = True
-                        break
-                    ws.cell(row=row_idx, column=x_col).value = 0  # Despacho
-                    processed_walmart += 1
-                    notify_progress(processed_walmart, total_walmart_rows)
-                if cancelled:
-                    notify_status(
-                        f"Proceso cancelado. Guardando archivo... ({processed_walmart}/{total_walmart_rows})"
-                    )
-                    break
-                if diff > 0:
-                    ws.cell(row=first_row, column=x_col).value = diff  # Despacho
+                columns.apply_walmart_group(row_indices)
+                if results is not None:
+                    for row_idx in row_indices:
+                        results.emit(row_idx, code_key, "walmart", columns.x_out[row_idx], None, "walmart")
+                processed_walmart += len(row_indices)
+                notify_progress(processed_walmart, total_walmart_rows)
 
             if not cancelled:
                 notify_status("Walmart terminado.")
 
-        out_path = Path(file_path)
-        output_file = out_path.with_name(f"{out_path.stem}_con_envios{out_path.suffix}")
-        wb.save(output_file)
-        if cancelled:
+        if timing is not None:
+            timing.add_run_phase("walmart", phase_started)
+            phase_started = time.perf_counter()
+        wb = await workbook_task
+        if timing is not None:
+            timing.add_run_phase("workbook_wait", phase_started)
+            phase_started = time.perf_counter()
+        await asyncio.to_thread(columns.write, wb["Reporte"], x_col, y_col)
+        if timing is not None:
+            timing.add_run_phase("write", phase_started)
+            phase_started = time.perf_counter()
+        await asyncio.to_thread(wb.save, output_file)
+        timing_summary = None
+        if timing is not None:
+            timing.add_run_phase("save", phase_started)
+            timing_summary = timing.summary(processed_ml)
+            write_timing_summary(output_file.with_name(f"{output_file.stem}.timing_summary.json"), timing_summary)
+        if journal is not None:
+            # La bitacora solo se borra si quedaron resueltos todos los codigos de ML; con
+            # cancelacion, corte o codigos sin dato queda para reanudar.
+            journal.close(discard=not cancelled and not session_lost and not failed_codes)
+            journal = None
+        if session_lost:
+            reason = (
+                "Chrome se cerro o perdio la conexion: abrelo con el login"
+                if chrome_lost
+                else "Sesion vencida: inicia sesion de nuevo"
+            )
+            message = (
+                f"{reason} y vuelve a procesar (se retoma donde quedo). "
+                f"MercadoLibre: {processed_ml}/{total_rows}. "
+                f"Archivo parcial: {output_file}"
+            )
+        elif cancelled:
             message = (
                 "Proceso cancelado. "
                 f"MercadoLibre: {processed_ml}/{total_rows}. "
@@ -586,107 +1319,1781 @@ async def process_excel(
             )
         else:
             message = (
-                "Listo. "
+                f"{'Listo con codigos sin dato' if failed_codes else 'Listo'}. "
                 f"MercadoLibre: {processed_ml}/{total_rows}. "
                 f"Walmart: {processed_walmart}/{total_walmart_rows}. "
                 f"Archivo guardado en: {output_file}"
             )
+        failed_rows = sum(failed_codes.values())
+        if failed_codes:
+            message += f" Sin dato (en blanco): {len(failed_codes)} codigo(s), {failed_rows} fila(s)."
+        if saved_fetches:
+            message += f" Consultas ahorradas por codigos repetidos: {saved_fetches}."
+        if cache is not None:
+            message += f" Cache: {cache.hits} aciertos."
+        if blocker is not None:
+            message += f" {blocker.summary()}"
+        if listing_harvest and total_rows:
+            message += f" Listado: {listing_rows}/{total_rows} filas ({listing_rows / total_rows:.0%})."
+        if watchdog is not None and watchdog.samples:
+            message += (
+                f" Memoria: pico {watchdog.peak_rss_mb:.0f} MB, "
+                f"{watchdog.tab_recycles + watchdog.full_recycles} renovacion(es)."
+            )
+        if fetch_stats is not None and fetch_stats["retries"]:
+            message += (
+                f" Reintentos: {fetch_stats['retries']} "
+                f"({fetch_stats['recovered_by_retry']} recuperados)."
+            )
         print(f"[excel] {message}")
         notify_status(message)
+        summary = {
+            "status": (
+                "relogin_required"
+                if session_lost
+                else "cancelled" if cancelled else "incomplete" if failed_codes else "ok"
+            ),
+            "input": str(file_path),
+            "output": str(output_file),
+            "ml_rows": total_rows,
+            "ml_processed": processed_ml,
+            "ml_unique_codes": len(ml_groups),
+            "saved_fetches": saved_fetches,
+            "shared_hits": shared_hits,
+            "walmart_rows": total_walmart_rows,
+            "walmart_processed": processed_walmart,
+            "cache_hits": cache.hits if cache is not None else 0,
+            "blocked_requests": blocker.blocked if blocker is not None else 0,
+            "failed_codes": len(failed_codes),
+            "failed_rows": failed_rows,
+            "elapsed_seconds": round(time.perf_counter() - started_at, 3),
+        }
+        if chrome_lost:
+            summary["stop_reason"] = "chrome_closed"
+        if first_row_seconds is not None:
+            summary["first_row_seconds"] = round(first_row_seconds, 3)
+        if len(worker_contexts) > 1:
+            summary["shards"] = len(worker_contexts)
+        if watchdog is not None:
+            summary["memory"] = watchdog.summary()
+        if results is not None:
+            summary["results"] = str(results.path)
+        if listing_harvest:
+            summary["listing_rows"] = listing_rows
+            summary["listing_codes"] = listing_codes
+            summary["listing_pages"] = listing_pages
+            summary["listing_share"] = round(listing_rows / total_rows, 4) if total_rows else 0.0
+        if fetch_stats is not None:
+            summary.update(fetch_stats)
+        if timing_summary is not None:
+            summary["timing"] = timing_summary
+        notify_summary(summary)
         return cancelled
     except Exception as exc:
         print(f"[excel] Error procesando Excel: {exc}")
         notify_status(f"Error procesando Excel: {exc}")
         return False
     finally:
-        try:
-            await playwright.stop()
-        except Exception:
-            pass
-
-
-async def fetch_amount_for_code(context, code: str, url: str) -> int | None:
+        if not workbook_task.done():
+            workbook_task.cancel()
+        elif not workbook_task.cancelled():
+            workbook_task.exception()
+        if blocker is not None:
+            await blocker.uninstall()
+        if journal is not None:
+            journal.close()
+        if timing is not None:
+            timing.close()
+        if results is not None:
+            await results.close()
+        if cache is not None:
+            cache.close()
+        if playwright is not None:
+            try:
+                await playwright.stop()
+            except Exception:
+                pass
+
+
+def write_timing_summary(path: Path, summary: dict) -> None:
+    """
+    Guarda el resumen de tiempos en JSON y lo imprime fase por fase.
+    """
     try:
-        page = await context.new_page()
-    except Exception as exc:
-        print(f"[{code}] No se pudo abrir una nueva pestaña: {exc}")
-        return None
+        path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    except OSError as exc:
+        print(f"[tiempos] No se pudo guardar el resumen: {exc}")
+    for phase, stats in summary["phases"].items():
+        print(
+            f"[tiempos] {phase}: p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms "
+            f"max={stats['max_ms']}ms (n={stats['n']})"
+        )
+    for phase, seconds in summary["run_phases_s"].items():
+        print(f"[tiempos] {phase}: {seconds}s")
+    print(
+        f"[tiempos] {summary['rows_per_s']} filas/s, fallback a Bonificaciones {summary['fallback_rate']:.1%}, "
+        f"timeouts {summary['timeouts']}, errores {summary['errors']}."
+    )
 
-    try:
-        page.set_default_timeout(20000)
-        await page.goto(url, wait_until="domcontentloaded")
 
-        text = await extract_amount_text(page, "Envíos", timeout_ms=2000, fast_fail=True)
-        source = "Envíos"
+def expand_report_paths(paths) -> list[Path]:
+    """
+    Convierte archivos y carpetas en la lista de Excel a procesar. De las carpetas se toman
+    los .xlsx, sin las salidas *_con_envios ni los archivos temporales de Excel (~$).
+    """
+    files: list[Path] = []
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            for candidate in sorted(path.glob("*.xlsx")):
+                if candidate.stem.endswith("_con_envios") or candidate.name.startswith("~$"):
+                    continue
+                files.append(candidate)
+        else:
+            files.append(path)
+    return files
 
-        if text is None:
-            text = await extract_amount_text(page, "Bonificaciones", timeout_ms=1000, fast_fail=True)
-            source = "Bonificaciones" if text else None
 
-        if text is None:
-            print(f"[{code}] No se encontraron Envíos ni Bonificaciones. Valor: $ 0")
-            return 0
+async def process_batch(
+    file_paths,
+    on_progress=None,
+    on_status=None,
+    cancel_event: threading.Event | None = None,
+    cdp_endpoint: str | None = None,
+    output_dir: str | None = None,
+    on_summary=None,
+    context=None,
+    contexts: list | None = None,
+    **options,
+) -> bool:
+    """
+    Procesa varios reportes con una sola conexion CDP (la de context si se entrega, o los
+    contexts de una ShardFleet). Los
+    codigos repetidos entre archivos se consultan una vez; cada archivo guarda su propio
+    _con_envios y on_summary recibe el resumen combinado. Las opciones extra (concurrency,
+    engine, cache...) van a process_excel. Devuelve True si se cancelo.
+    """
+    files = expand_report_paths(file_paths)
+    summaries: list[dict] = []
+    cancelled = False
+    if contexts:
+        context = contexts[0]
 
-        parsed = parse_amount(text)
-        if parsed is None:
-            print(f"[{code}] No se pudo interpretar el valor de {source}: {text}")
-            return None
+    def notify_status(message: str) -> None:
+        if on_status:
+            on_status(message)
 
-        if parsed < 0:
-            parsed = 0
+    async_playwright = await asyncio.to_thread(get_async_playwright)
+    if async_playwright is None:
+        notify_status("Falta Playwright. Instala con: pip install playwright && python -m playwright install")
+        return False
+    if context is None and cdp_endpoint is None:
+        if REMOTE_DEBUG_PORT is None or not wait_for_port("localhost", REMOTE_DEBUG_PORT, attempts=10, delay=0.4):
+            print("[lote] No hay puerto de depuracion. Pulsa el boton de login primero.")
+            notify_status("No hay puerto de depuracion. Pulsa el boton de login primero.")
+            return False
+        cdp_endpoint = f"http://localhost:{REMOTE_DEBUG_PORT}"
 
-        print(f"[{code}] Envíos ({source}): {format_amount(parsed)}")
-        return parsed
-    except PlaywrightTimeoutError:
-        print(f"[{code}] Timeout esperando datos. Revisa si hay login pendiente.")
-        return None
+    started_at = time.perf_counter()
+    shared_amounts: dict[str, int] = {}
+    playwright = None
+    try:
+        if context is None:
+            playwright = await async_playwright().start()
+            browser = await playwright.chromium.connect_over_cdp(cdp_endpoint)
+            if not browser.contexts:
+                print("[lote] No hay contextos en Chrome. ¿Cerraste la ventana de login?")
+                notify_status("No hay contextos en Chrome. ¿Cerraste la ventana de login?")
+                return False
+            context = browser.contexts[0]
+
+        for index, path in enumerate(files, start=1):
+            if cancel_event and cancel_event.is_set():
+                cancelled = True
+                break
+            prefix = f"[{index}/{len(files)}] {path.name}"
+            print(f"[lote] {prefix}")
+            last_status: list[str] = [""]
+            file_summary: dict = {}
+
+            def file_status(message: str, prefix=prefix, last_status=last_status) -> None:
+                last_status[0] = message
+                notify_status(f"{prefix}: {message}")
+
+            output_path = None
+            if output_dir:
+                output_path = str(Path(output_dir) / f"{path.stem}_con_envios{path.suffix}")
+            file_cancelled = await process_excel(
+                str(path),
+                on_progress=on_progress,
+                on_status=file_status,
+                cancel_event=cancel_event,
+                output_path=output_path,
+                on_summary=file_summary.update,
+                context=context,
+                contexts=contexts,
+                shared_amounts=shared_amounts,
+                **options,
+            )
+            if not file_summary:
+                file_summary = {"status": "error", "input": str(path), "error": last_status[0]}
+            summaries.append(file_summary)
+            if file_cancelled:
+                cancelled = True
+                break
     except Exception as exc:
-        print(f"[{code}] Error extrayendo datos: {exc}")
-        return None
+        print(f"[lote] Error procesando lote: {exc}")
+        notify_status(f"Error procesando lote: {exc}")
+        summaries.append({"status": "error", "error": str(exc)})
     finally:
-        try:
-            await page.close()
-        except Exception:
-            pass
+        if playwright is not None:
+            try:
+                await playwright.stop()
+            except Exception:
+                pass
+
+    done = [
+        summary
+        for summary in summaries
+        if summary.get("status") in ("ok", "incomplete", "cancelled", "relogin_required")
+    ]
+    failed = len(summaries) - len(done)
+    relogin = any(summary.get("status") == "relogin_required" for summary in done)
+    failed_rows = sum(summary.get("failed_rows", 0) for summary in done)
+    if failed:
+        status = "error"
+    elif relogin:
+        status = "relogin_required"
+    elif cancelled:
+        status = "cancelled"
+    else:
+        status = "incomplete" if failed_rows else "ok"
+    combined = {
+        "status": status,
+        "files": summaries,
+        "files_total": len(files),
+        "files_done": len(done),
+        "ml_rows": sum(summary.get("ml_processed", 0) for summary in done),
+        "walmart_rows": sum(summary.get("walmart_processed", 0) for summary in done),
+        "shared_hits": sum(summary.get("shared_hits", 0) for summary in done),
+        "failed_codes": sum(summary.get("failed_codes", 0) for summary in done),
+        "failed_rows": failed_rows,
+        "elapsed_seconds": round(time.perf_counter() - started_at, 3),
+    }
+    message = (
+        f"Lote {'cancelado' if cancelled else 'terminado'}: {len(done)}/{len(files)} archivos. "
+        f"MercadoLibre: {combined['ml_rows']} filas. Walmart: {combined['walmart_rows']} filas. "
+        f"Codigos compartidos entre archivos: {combined['shared_hits']}."
+    )
+    if failed:
+        message += f" Con error: {failed}."
+    if failed_rows:
+        message += f" Filas sin dato (en blanco): {failed_rows}."
+    if relogin:
+        message += " Sesion vencida: inicia sesion de nuevo y vuelve a procesar."
+    print(f"[lote] {message}")
+    notify_status(message)
+    if on_summary:
+        on_summary(combined)
+    return cancelled
+
+
+class ReportError(Exception):
+    """
+    El Excel se pudo leer pero no tiene la forma esperada (hoja o columnas).
+    """
 
-def find_free_port() -> int:
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(("localhost", 0))
-        return s.getsockname()[1]
 
+@dataclass
+class ReportScan:
+    """
+    Lo que el procesamiento necesita de la hoja Reporte, leido en una sola pasada.
+    """
+
+    w_col: int
+    x_col: int
+    y_col: int
+    ml_groups: dict[str, list[int]] = field(default_factory=dict)
+    walmart_groups: dict[str, list[int]] = field(default_factory=dict)
+    w_rows: list[int] = field(default_factory=list)
+    w_raw: list = field(default_factory=list)
+    y_rows: list[int] = field(default_factory=list)
+    y_raw: list = field(default_factory=list)
+    columns: "ReportColumns | None" = None
 
-def wait_for_port(host: str, port: int, attempts: int = 15, delay: float = 0.4) -> bool:
-    for _ in range(attempts):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(delay)
-            if sock.connect_ex((host, port)) == 0:
-                return True
-        time.sleep(delay)
-    return False
 
+def _last_filled_column(values) -> int:
+    for idx in range(len(values) - 1, -1, -1):
+        value = values[idx]
+        if value is None or (isinstance(value, str) and not value.strip()):
+            continue
+        return idx + 1
+    return 0
 
-def start_login_browser(start_url: str = LOGIN_URL) -> None:
+
+def scan_report(file_path: str) -> ReportScan:
     """
-    Lanza Chrome normal (sin banderas de automatizacion) con remote debugging para que el usuario
-    haga login y guarde cookies en ./ml_profile. Mantiene el puerto en REMOTE_DEBUG_PORT.
+    Recorre la hoja Reporte en modo solo lectura (iter_rows con values_only) una sola vez.
+    Las columnas W/X/Y salen de la ultima columna con titulo en el encabezado; si el
+    encabezado no alcanza, se usa la ultima columna con datos vista en la misma pasada.
     """
-    global REMOTE_DEBUG_PORT, CHROME_PROCESS
+    wb = get_load_workbook()(file_path, read_only=True)
+    try:
+        if "Reporte" not in wb.sheetnames:
+            raise ReportError("No se encontro la hoja 'Reporte' en el Excel.")
+        ws = wb["Reporte"]
+        # En solo lectura openpyxl recorta al <dimension> del archivo, que muchas herramientas
+        # (no Excel) dejan mal (p. ej. "A1"): se descarta para leer todas las celdas reales.
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        last_data_col = _last_filled_column(header)
+        scan_all_columns = last_data_col < 3
+
+        scan = ReportScan(w_col=last_data_col - 2, x_col=last_data_col - 1, y_col=last_data_col)
+        # Solo si el encabezado no alcanza se guardan las filas para resolver W/Y al final.
+        pending_rows: list[tuple[int, str, tuple]] = []
+        for row_idx, values in enumerate(rows, start=2):
+            if scan_all_columns:
+                last_data_col = max(last_data_col, _last_filled_column(values))
+            channel = values[5] if len(values) > 5 else None  # F
+            channel_norm = str(channel).strip().lower()
+            if channel_norm not in ("mercadolibre", "walmart"):
+                continue
+            code_key = normalize_sale_code(values[7] if len(values) > 7 else None)  # H
+            if not code_key:
+                continue
+            if channel_norm == "mercadolibre":
+                # Una orden con varios items aparece en varias filas con el mismo codigo.
+                scan.ml_groups.setdefault(code_key, []).append(row_idx)
+            else:
+                scan.walmart_groups.setdefault(code_key, []).append(row_idx)
+            if scan_all_columns:
+                pending_rows.append((row_idx, channel_norm, values))
+            else:
+                _store_report_values(scan, row_idx, channel_norm, values)
+    finally:
+        wb.close()
 
-    chrome_exe = find_chrome_executable()
-    if not chrome_exe:
-        messagebox.showerror(
+    if last_data_col < 3:
+        raise ReportError("No se pudo detectar la ultima columna con datos.")
+
+    if scan_all_columns:
+        scan.w_col, scan.x_col, scan.y_col = last_data_col - 2, last_data_col - 1, last_data_col
+        for row_idx, channel_norm, values in pending_rows:
+            _store_report_values(scan, row_idx, channel_norm, values)
+    scan.columns = ReportColumns.from_scan(scan)
+    return scan
+
+
+def _store_report_values(scan: ReportScan, row_idx: int, channel_norm: str, values: tuple) -> None:
+    scan.w_rows.append(row_idx)
+    scan.w_raw.append(values[scan.w_col - 1] if len(values) >= scan.w_col else None)
+    if channel_norm == "walmart":
+        scan.y_rows.append(row_idx)
+        scan.y_raw.append(values[scan.y_col - 1] if len(values) >= scan.y_col else None)
+
+
+class ReportColumns:
+    """
+    Columnas W e Y de la hoja Reporte como arreglos de enteros indexados por numero de
+    fila (vacios o ilegibles = 0). Los calculos de ML y Walmart trabajan sobre estos
+    arreglos y dejan los resultados en x_out/y_out, que se escriben a la hoja de una vez.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.w = array("q", bytes(8 * size))
+        self.y = array("q", bytes(8 * size))
+        self.x_out: dict[int, int] = {}
+        self.y_out: dict[int, int] = {}
+
+    @classmethod
+    def from_scan(cls, scan: ReportScan) -> "ReportColumns":
+        size = max(scan.w_rows, default=0) + 1
+        columns = cls(size)
+        for row_idx, amount in zip(scan.w_rows, normalize_amounts(scan.w_raw)):
+            columns.w[row_idx] = amount
+        for row_idx, amount in zip(scan.y_rows, normalize_amounts(scan.y_raw)):
+            columns.y[row_idx] = amount
+        # Los valores crudos ya no hacen falta.
+        scan.w_raw = []
+        scan.y_raw = []
+        return columns
+
+    def apply_ml(self, groups: dict[str, list[int]], amounts: dict[str, int]) -> None:
+        """
+        X = monto de envio y Y = W + X para cada fila de los codigos resueltos.
+        """
+        w = self.w
+        x_out = self.x_out
+        y_out = self.y_out
+        for sale_code, amount in amounts.items():
+            for row_idx in groups[sale_code]:
+                x_out[row_idx] = amount
+                y_out[row_idx] = w[row_idx] + amount
+
+    def apply_walmart_group(self, row_indices: list[int]) -> None:
+        """
+        Despacho del grupo: max(Y) - sum(W) en la primera fila (si es positivo), 0 en el resto.
+        """
+        w = self.w
+        y = self.y
+        diff = max(y[row_idx] for row_idx in row_indices) - sum(w[row_idx] for row_idx in row_indices)
+        x_out = self.x_out
+        for row_idx in row_indices:
+            x_out[row_idx] = 0
+        if diff > 0:
+            x_out[row_indices[0]] = diff
+
+    def write(self, ws, x_col: int, y_col: int) -> int:
+        """
+        Vuelca x_out/y_out en la hoja. Devuelve la cantidad de celdas escritas.
+        """
+        cell = ws.cell
+        for row_idx, value in self.x_out.items():
+            cell(row=row_idx, column=x_col, value=value)
+        for row_idx, value in self.y_out.items():
+            cell(row=row_idx, column=y_col, value=value)
+        return len(self.x_out) + len(self.y_out)
+
+
+class RunJournal:
+    """
+    Bitacora append-only (JSONL) junto al Excel de entrada con un registro por codigo resuelto.
+    Si el proceso muere antes de wb.save, la siguiente corrida sobre el mismo archivo (mismo
+    hash) retoma los codigos ya resueltos y solo consulta el resto.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        source = Path(file_path)
+        self.path = source.with_name(f"{source.name}.envios.jsonl")
+        self.fingerprint = self._fingerprint(source)
+        self.resumed: dict[str, int] = {}
+        self._load()
+        self._handle = self.path.open("a", encoding="utf-8")
+        if not self.resumed:
+            self._write({"file": source.name, "sha256": self.fingerprint})
+
+    @staticmethod
+    def _fingerprint(source: Path) -> str:
+        digest = hashlib.sha256()
+        with source.open("rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        records: dict[str, int] = {}
+        valid = False
+        with self.path.open(encoding="utf-8") as fh:
+            for line_no, line in enumerate(fh):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # linea truncada por un corte a mitad de escritura
+                if line_no == 0:
+                    valid = record.get("sha256") == self.fingerprint
+                    if not valid:
+                        break
+                    continue
+                if "code" in record and "amount" in record:
+                    records[str(record["code"])] = int(record["amount"])
+        if valid:
+            self.resumed = records
+        else:
+            self.path.unlink()
+
+    def _write(self, record: dict) -> None:
+        self._handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._handle.flush()
+
+    def record(self, code: str, amount: int, rows: list[int]) -> None:
+        self._write({"code": code, "amount": amount, "rows": rows, "ts": time.time()})
+
+    def close(self, discard: bool = False) -> None:
+        try:
+            self._handle.close()
+        except Exception:
+            pass
+        if discard:
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+
+TIMING_PHASES = (
+    "cache",
+    "http",
+    "new_page",
+    "goto",
+    "wait_rows",
+    "extract",
+    "settle_rows",
+    "close",
+    "total",
+)
+_NO_PHASE = contextlib.nullcontext()
+
+
+class RowTrace:
+    """
+    Tiempos (segundos) por fase de la consulta de un codigo y como se resolvio.
+    status: "cache", "listing", "http", "page", "login", "timeout", "closed" (Chrome o la
+    conexion CDP ya no existen) o "error".
+    """
+
+    __slots__ = ("phases", "status", "source", "fallback")
+
+    def __init__(self) -> None:
+        self.phases: dict[str, float] = {}
+        self.status = "page"
+        self.source: str | None = None
+        self.fallback = False
+
+    @contextlib.contextmanager
+    def span(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + time.perf_counter() - started
+
+
+def timed_phase(trace: RowTrace | None, phase: str):
+    """
+    Mide una fase si hay trace; sin trace devuelve un contexto vacio (costo despreciable).
+    """
+    if trace is None:
+        return _NO_PHASE
+    return trace.span(phase)
+
+
+class TimingRecorder:
+    """
+    Escribe una linea por codigo consultado (JSONL o CSV segun la extension) y arma el
+    resumen de la corrida: p50/p95/max por fase, tasa de fallback a Bonificaciones,
+    timeouts y filas por segundo. Las fases de la corrida (lectura, guardado) van aparte.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.csv = self.path.suffix.lower() == ".csv"
+        self.samples: dict[str, list[float]] = {}
+        self.run_phases: dict[str, float] = {}
+        self.codes = 0
+        self.fetched = 0
+        self.fallbacks = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.started_at = time.perf_counter()
+        self._handle = self.path.open("w", encoding="utf-8", newline="")
+        if self.csv:
+            self._writer = csv.writer(self._handle)
+            self._writer.writerow(["code", "rows", "amount", "status", "source", "fallback", *TIMING_PHASES])
+
+    def new_trace(self) -> RowTrace:
+        return RowTrace()
+
+    def add_run_phase(self, phase: str, started: float) -> None:
+        self.run_phases[phase] = self.run_phases.get(phase, 0.0) + time.perf_counter() - started
+
+    def record(self, code: str, rows: int, amount: int | None, trace: RowTrace) -> None:
+        self.codes += 1
+        if trace.status != "cache":
+            self.fetched += 1
+            self.fallbacks += trace.fallback
+        self.timeouts += trace.status == "timeout"
+        self.errors += trace.status in ("error", "closed")
+        for phase, seconds in trace.phases.items():
+            self.samples.setdefault(phase, []).append(seconds)
+        if self.csv:
+            self._writer.writerow(
+                [code, rows, amount, trace.status, trace.source or "", int(trace.fallback)]
+                + [round(trace.phases[p], 4) if p in trace.phases else "" for p in TIMING_PHASES]
+            )
+        else:
+            record = {
+                "code": code,
+                "rows": rows,
+                "amount": amount,
+                "status": trace.status,
+                "source": trace.source,
+                "fallback": trace.fallback,
+                **{phase: round(seconds, 4) for phase, seconds in trace.phases.items()},
+            }
+            self._handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def summary(self, rows_done: int) -> dict:
+        elapsed = time.perf_counter() - self.started_at
+
+        def stats(values: list[float]) -> dict:
+            ordered = sorted(values)
+            pick = lambda pct: ordered[min(len(ordered) - 1, int(pct * len(ordered)))]  # noqa: E731
+            return {
+                "n": len(ordered),
+                "p50_ms": round(pick(0.50) * 1000, 1),
+                "p95_ms": round(pick(0.95) * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+            }
+
+        return {
+            "sidecar": str(self.path),
+            "phases": {phase: stats(self.samples[phase]) for phase in TIMING_PHASES if self.samples.get(phase)},
+            "run_phases_s": {phase: round(seconds, 3) for phase, seconds in self.run_phases.items()},
+            "codes": self.codes,
+            "fetched": self.fetched,
+            "fallback_rate": round(self.fallbacks / self.fetched, 3) if self.fetched else 0.0,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "rows_per_s": round(rows_done / elapsed, 2) if elapsed else 0.0,
+            "elapsed_s": round(elapsed, 3),
+        }
+
+    def close(self) -> None:
+        try:
+            self._handle.close()
+        except Exception:
+            pass
+
+
+RESULT_FIELDS = ("row", "code", "channel", "amount", "source", "status", "latency_ms")
+
+
+class ResultsSink:
+    """
+    Archivo de resultados por fila (JSONL o CSV segun la extension) que se escribe mientras
+    corre el proceso, para que otras herramientas lo lean sin esperar el xlsx. emit() solo
+    encola (nunca bloquea a los workers); una tarea de fondo escribe por lotes en un hilo y
+    hace flush despues de cada lote.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.csv = self.path.suffix.lower() == ".csv"
+        self.rows = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._handle = self.path.open("w", encoding="utf-8", newline="")
+        if self.csv:
+            self._writer = csv.writer(self._handle)
+            self._writer.writerow(RESULT_FIELDS)
+            self._handle.flush()
+        self._task = asyncio.ensure_future(self._run())
+
+    def emit(
+        self,
+        row: int,
+        code: str,
+        channel: str,
+        amount: int | None,
+        source: str | None,
+        status: str,
+        latency: float | None = None,
+    ) -> None:
+        latency_ms = round(latency * 1000, 1) if latency is not None else None
+        self._queue.put_nowait((row, code, channel, amount, source, status, latency_ms))
+
+    def _write_batch(self, batch: list[tuple]) -> None:
+        if self.csv:
+            self._writer.writerows(["" if value is None else value for value in record] for record in batch)
+        else:
+            self._handle.writelines(
+                json.dumps(dict(zip(RESULT_FIELDS, record)), ensure_ascii=False) + "\n" for record in batch
+            )
+        self._handle.flush()
+        self.rows += len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            done = batch[-1] is None
+            batch = [record for record in batch if record is not None]
+            if batch:
+                try:
+                    await asyncio.to_thread(self._write_batch, batch)
+                except Exception as exc:
+                    print(f"[resultados] Error escribiendo {self.path}: {exc}")
+            if done:
+                return
+
+    async def close(self) -> None:
+        self._queue.put_nowait(None)
+        await asyncio.gather(self._task, return_exceptions=True)
+        try:
+            self._handle.close()
+        except Exception:
+            pass
+
+
+class ProgressState:
+    """
+    Avance compartido entre el procesamiento y quien lo muestra. Los workers solo
+    actualizan contadores bajo un lock; la GUI (cada PROGRESS_REFRESH_MS) o la consola
+    (cada PROGRESS_LOG_SECONDS) leen snapshot() a su ritmo, sin un evento por fila.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.processed = 0
+            self.total = 0
+            self.status = ""
+            self.cache_hits = 0
+            self.fallbacks = 0
+            self.failures = 0
+            self.version = 0
+            self._samples: list[tuple[float, int]] = []
+
+    def set_progress(self, processed: int, total: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if total != self.total or processed < self.processed:
+                # Otra etapa (Walmart, siguiente archivo del lote): la velocidad arranca de cero.
+                self._samples = []
+            self.processed = processed
+            self.total = total
+            self._samples.append((now, processed))
+            while len(self._samples) > 2 and now - self._samples[0][0] > PROGRESS_RATE_WINDOW_SECONDS:
+                self._samples.pop(0)
+            self.version += 1
+
+    def set_status(self, text: str) -> None:
+        with self._lock:
+            self.status = text
+            self.version += 1
+
+    def record_code(self, trace: RowTrace | None, failed: bool) -> None:
+        with self._lock:
+            if trace is not None:
+                self.cache_hits += trace.status == "cache"
+                self.fallbacks += trace.fallback
+            self.failures += failed
+            self.version += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            rate = 0.0
+            if len(self._samples) > 1:
+                (first_t, first_p), (last_t, last_p) = self._samples[0], self._samples[-1]
+                if last_t > first_t:
+                    rate = (last_p - first_p) / (last_t - first_t)
+            remaining = max(self.total - self.processed, 0)
+            return {
+                "processed": self.processed,
+                "total": self.total,
+                "status": self.status,
+                "rows_per_s": rate,
+                "eta_s": remaining / rate if rate > 0 else None,
+                "cache_hits": self.cache_hits,
+                "fallbacks": self.fallbacks,
+                "failures": self.failures,
+                "version": self.version,
+            }
+
+    @staticmethod
+    def describe(snapshot: dict) -> str:
+        """
+        Linea corta con velocidad, ETA y contadores, p.ej. "8.5 filas/s, ETA 1:05, ...".
+        """
+        eta = snapshot["eta_s"]
+        eta_text = f"{int(eta) // 60}:{int(eta) % 60:02d}" if eta is not None else "--:--"
+        return (
+            f"{snapshot['rows_per_s']:.1f} filas/s, ETA {eta_text}, "
+            f"cache {snapshot['cache_hits']}, fallback {snapshot['fallbacks']}, "
+            f"fallos {snapshot['failures']}"
+        )
+
+
+@contextlib.contextmanager
+def progress_log(progress: ProgressState, interval: float = PROGRESS_LOG_SECONDS):
+    """
+    Imprime el avance cada interval segundos (solo si cambio) mientras dura el bloque.
+    """
+    stop = threading.Event()
+
+    def loop() -> None:
+        last_version = -1
+        while not stop.wait(interval):
+            snapshot = progress.snapshot()
+            if snapshot["version"] == last_version or not snapshot["total"]:
+                continue
+            last_version = snapshot["version"]
+            print(
+                f"[progreso] {snapshot['processed']}/{snapshot['total']} - {ProgressState.describe(snapshot)}",
+                flush=True,
+            )
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+class AmountCache:
+    """
+    Cache en SQLite de codigo de venta -> (monto, fuente, fecha de consulta).
+    Una venta cerrada no cambia su valor de Envíos, asi que las re-ejecuciones
+    solo consultan los codigos que no se han visto (o que vencieron por TTL).
+    """
+
+    def __init__(self, db_path: Path = CACHE_DB_PATH, ttl_seconds: float | None = DEFAULT_CACHE_TTL_SECONDS) -> None:
+        self.db_path = Path(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path))
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS amounts ("
+                " code TEXT PRIMARY KEY,"
+                " amount INTEGER NOT NULL,"
+                " source TEXT,"
+                " fetched_at REAL NOT NULL)"
+            )
+
+    def _lookup(self, code: str) -> tuple[int, str | None] | None:
+        row = self._conn.execute(
+            "SELECT amount, source, fetched_at FROM amounts WHERE code = ?",
+            (str(code).strip(),),
+        ).fetchone()
+        if row is None:
+            return None
+        amount, source, fetched_at = row
+        if self.ttl_seconds is not None and time.time() - fetched_at > self.ttl_seconds:
+            return None
+        return amount, source
+
+    def get(self, code: str) -> tuple[int, str | None] | None:
+        cached = self._lookup(code)
+        if cached is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cached
+
+    def contains(self, code: str) -> bool:
+        """
+        Como get, pero sin contar aciertos ni fallos.
+        """
+        return self._lookup(code) is not None
+
+    def put(self, code: str, amount: int, source: str | None) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO amounts (code, amount, source, fetched_at) VALUES (?, ?, ?, ?)",
+                (str(code).strip(), int(amount), source, time.time()),
+            )
+
+    def close(self) -> None:
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+
+class ResourceBlocker:
+    """
+    Intercepta los requests del contexto CDP y aborta los que la extraccion no necesita:
+    tipos de recurso bloqueados, URLs de analitica/tracking y scripts de terceros.
+    ALLOWED_URL_PATTERNS (o allow_patterns) siempre gana sobre las reglas de bloqueo.
+    """
+
+    def __init__(
+        self,
+        resource_types=BLOCKED_RESOURCE_TYPES,
+        deny_patterns=BLOCKED_URL_PATTERNS,
+        allow_patterns=ALLOWED_URL_PATTERNS,
+        first_party_hosts=FIRST_PARTY_HOSTS,
+        block_third_party_scripts: bool = True,
+    ) -> None:
+        self.resource_types = frozenset(resource_types)
+        self.deny_patterns = tuple(deny_patterns)
+        self.allow_patterns = tuple(allow_patterns)
+        self.first_party_hosts = tuple(first_party_hosts)
+        self.block_third_party_scripts = block_third_party_scripts
+        self.allowed = 0
+        self.blocked = 0
+        self.blocked_by_type: dict[str, int] = {}
+        self.estimated_bytes_saved = 0
+        self._contexts: list = []
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        if any(pattern in url for pattern in self.allow_patterns):
+            return False
+        if resource_type in self.resource_types:
+            return True
+        if any(pattern in url for pattern in self.deny_patterns):
+            return True
+        if self.block_third_party_scripts and resource_type == "script":
+            host = url.split("://", 1)[-1].split("/", 1)[0].split(":", 1)[0]
+            return not any(host == h or host.endswith("." + h) for h in self.first_party_hosts)
+        return False
+
+    async def _handle(self, route) -> None:
+        request = route.request
+        resource_type = request.resource_type
+        try:
+            if self.should_block(request.url, resource_type):
+                self.blocked += 1
+                self.blocked_by_type[resource_type] = self.blocked_by_type.get(resource_type, 0) + 1
+                self.estimated_bytes_saved += ESTIMATED_RESOURCE_BYTES.get(resource_type, 0)
+                await route.abort()
+            else:
+                self.allowed += 1
+                await route.continue_()
+        except Exception:
+            # La pestaña pudo cerrarse mientras el request estaba en vuelo.
+            pass
+
+    async def install(self, context) -> None:
+        await context.route("**/*", self._handle)
+        self._contexts.append(context)
+
+    async def uninstall(self) -> None:
+        contexts, self._contexts = self._contexts, []
+        for context in contexts:
+            try:
+                await context.unroute("**/*", self._handle)
+            except Exception:
+                pass
+
+    def summary(self) -> str:
+        by_type = ", ".join(f"{k}={v}" for k, v in sorted(self.blocked_by_type.items()))
+        saved_mb = self.estimated_bytes_saved / 1_000_000
+        return f"Bloqueados: {self.blocked} requests (~{saved_mb:.1f} MB){f' [{by_type}]' if by_type else ''}."
+
+
+class WarmTab:
+    """
+    Pestaña de larga vida de un worker: se navega de codigo en codigo en vez de abrir y
+    cerrar una por venta. Se reemplaza cuando se cierra o se cae (evento crash), cuando un
+    codigo termina en error/timeout (puede quedar trabada) y cada max_uses navegaciones.
+    """
+
+    def __init__(self, context, max_uses: int = DEFAULT_TAB_MAX_USES) -> None:
+        self.context = context
+        self.max_uses = max(1, max_uses)
+        self.page = None
+        self.uses = 0
+        self.replaced = 0
+        self._crashed = False
+        self._stale = False
+
+    def _on_crash(self, _page) -> None:
+        self._crashed = True
+
+    async def acquire(self):
+        page = self.page
+        if page is not None and (self._crashed or self._stale or self.uses >= self.max_uses or page.is_closed()):
+            await self.close()
+            self.replaced += 1
+        if self.page is None:
+            self.page = await self.context.new_page()
+            self.page.on("crash", self._on_crash)
+            self.uses = 0
+            self._crashed = False
+            self._stale = False
+        self.uses += 1
+        return self.page
+
+    def release(self, healthy: bool) -> None:
+        if not healthy:
+            self._stale = True
+
+    def retire(self) -> None:
+        """
+        Pide reemplazar la pestaña en la proxima adquisicion (sin cortar la navegacion actual).
+        """
+        if self.page is not None:
+            self._stale = True
+
+    async def close(self) -> None:
+        page, self.page = self.page, None
+        if page is None:
+            return
+        try:
+            await page.close()
+        except Exception:
+            pass
+
+
+def process_tree_rss(root_pids: list[int]) -> int | None:
+    """
+    RSS (bytes) de los procesos dados y sus descendientes, con psutil o /proc. None si no
+    hay forma de medirlo en esta plataforma.
+    """
+    psutil = get_psutil()
+    if psutil is not None:
+        total = 0
+        seen: set[int] = set()
+        for root_pid in root_pids:
+            try:
+                root = psutil.Process(root_pid)
+                processes = [root, *root.children(recursive=True)]
+            except psutil.Error:
+                continue
+            for process in processes:
+                if process.pid in seen:
+                    continue
+                seen.add(process.pid)
+                try:
+                    total += process.memory_info().rss
+                except psutil.Error:
+                    pass
+        return total
+    if not os.path.isdir("/proc"):
+        return None
+    children: dict[int, list[int]] = {}
+    rss: dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/status") as fh:
+                fields = dict(line.split(":", 1) for line in fh if ":" in line)
+        except OSError:
+            continue
+        pid = int(entry)
+        children.setdefault(int(fields.get("PPid", "0").strip()), []).append(pid)
+        rss[pid] = int(fields.get("VmRSS", "0 kB").split()[0]) * 1024
+    total, stack, seen = 0, list(root_pids), set()
+    while stack:
+        pid = stack.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+class MemoryWatchdog:
+    """
+    Muestrea cada interval segundos la memoria de Chrome: RSS del arbol de procesos (pids de
+    CDP SystemInfo.getProcessInfo, o CHROME_PROCESS) y heap JS de cada pestaña tibia con
+    CDP Performance.getMetrics. Una pestaña sobre tab_heap_mb se marca para reemplazo y, si
+    el total pasa rss_limit_mb, se renuevan todas (con enfriamiento entre renovaciones).
+    El reemplazo ocurre en la proxima adquisicion de cada pestaña, no a mitad de una carga.
+    Cada muestra queda como una linea JSONL en path.
+    """
+
+    def __init__(
+        self,
+        context,
+        path: Path,
+        interval: float = MEMORY_SAMPLE_SECONDS,
+        rss_limit_mb: float = DEFAULT_MEMORY_LIMIT_MB,
+        tab_heap_mb: float = DEFAULT_TAB_HEAP_LIMIT_MB,
+    ) -> None:
+        self.context = context
+        self.path = Path(path)
+        self.interval = interval
+        self.rss_limit_mb = rss_limit_mb
+        self.tab_heap_mb = tab_heap_mb
+        self.tabs: list[WarmTab] = []
+        self.samples = 0
+        self.peak_rss_mb = 0.0
+        self.peak_heap_mb = 0.0
+        self.tab_recycles = 0
+        self.full_recycles = 0
+        self._sessions: dict[int, object] = {}
+        self._last_full_recycle = 0.0
+        self._started = time.monotonic()
+        self._task: asyncio.Task | None = None
+        self._handle = self.path.open("w", encoding="utf-8")
+
+    def track(self, tab: "WarmTab | None") -> None:
+        if tab is not None:
+            self.tabs.append(tab)
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            self._handle.close()
+        except Exception:
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sample()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"[memoria] Error al muestrear: {exc}")
+            await asyncio.sleep(self.interval)
+
+    async def _browser_pids(self) -> list[int]:
+        browser = getattr(self.context, "browser", None)
+        if browser is not None:
+            try:
+                session = await browser.new_browser_cdp_session()
+                try:
+                    info = await session.send("SystemInfo.getProcessInfo")
+                finally:
+                    await session.detach()
+                pids = [int(process["id"]) for process in info.get("processInfo", [])]
+                if pids:
+                    return pids
+            except Exception:
+                pass
+        if CHROME_PROCESS is not None and CHROME_PROCESS.poll() is None:
+            return [CHROME_PROCESS.pid]
+        return []
+
+    async def _page_heap_mb(self, page) -> float | None:
+        session = self._sessions.get(id(page))
+        try:
+            if session is None:
+                session = await page.context.new_cdp_session(page)
+                await session.send("Performance.enable")
+                self._sessions[id(page)] = session
+            metrics = await session.send("Performance.getMetrics")
+        except Exception:
+            self._sessions.pop(id(page), None)
+            return None
+        for metric in metrics.get("metrics", []):
+            if metric.get("name") == "JSHeapUsedSize":
+                return metric["value"] / 1_000_000
+        return None
+
+    async def sample(self) -> dict:
+        pids = await self._browser_pids()
+        rss = process_tree_rss(pids) if pids else None
+        rss_mb = rss / 1_000_000 if rss is not None else None
+        heap_total = 0.0
+        retired = 0
+        live_pages: set[int] = set()
+        for tab in self.tabs:
+            page = tab.page
+            if page is None:
+                continue
+            live_pages.add(id(page))
+            heap_mb = await self._page_heap_mb(page)
+            if heap_mb is None:
+                continue
+            heap_total += heap_mb
+            if heap_mb > self.tab_heap_mb:
+                tab.retire()
+                retired += 1
+        # Sesiones de pestañas ya reemplazadas.
+        for key in [key for key in self._sessions if key not in live_pages]:
+            self._sessions.pop(key, None)
+
+        action = None
+        now = time.monotonic()
+        if (
+            rss_mb is not None
+            and rss_mb > self.rss_limit_mb
+            and now - self._last_full_recycle >= MEMORY_RECYCLE_COOLDOWN_SECONDS
+        ):
+            for tab in self.tabs:
+                tab.retire()
+            self._last_full_recycle = now
+            self.full_recycles += 1
+            action = "recycle_all"
+            print(f"[memoria] Chrome usa {rss_mb:.0f} MB (> {self.rss_limit_mb} MB): se renuevan las pestañas.")
+        elif retired:
+            self.tab_recycles += retired
+            action = f"recycle_tabs:{retired}"
+            print(f"[memoria] {retired} pestaña(s) sobre {self.tab_heap_mb} MB de heap JS: se renuevan.")
+
+        self.samples += 1
+        if rss_mb is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+        self.peak_heap_mb = max(self.peak_heap_mb, heap_total)
+        record = {
+            "t": round(now - self._started, 2),
+            "rss_mb": round(rss_mb, 1) if rss_mb is not None else None,
+            "js_heap_mb": round(heap_total, 1),
+            "tabs": len(live_pages),
+            "action": action,
+        }
+        self._handle.write(json.dumps(record) + "\n")
+        self._handle.flush()
+        return record
+
+    def summary(self) -> dict:
+        return {
+            "samples": self.samples,
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "peak_js_heap_mb": round(self.peak_heap_mb, 1),
+            "tab_recycles": self.tab_recycles,
+            "full_recycles": self.full_recycles,
+            "timeline": str(self.path),
+        }
+
+
+class FetchThrottle:
+    """
+    Control de carga para las consultas de detalle: token bucket opcional (rate por segundo
+    con rafaga burst) mas un limite de consultas simultaneas. Con adaptive=True el limite
+    sigue AIMD: sube de a poco (+1/limite) cuando las paginas vuelven rapido y se divide
+    a la mitad ante timeouts o errores (una vez por ventana de enfriamiento).
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        rate: float | None = None,
+        burst: int | None = None,
+        adaptive: bool = False,
+        min_limit: int = 1,
+        max_limit: int = MAX_CONCURRENCY,
+    ) -> None:
+        self.rate = rate
+        self.capacity = float(burst if burst is not None else max(1, limit))
+        self.tokens = self.capacity
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, limit)
+        self.limit = float(limit)
+        self.lowest_limit = self.limit
+        self.highest_limit = self.limit
+        self.active = 0
+        self.increases = 0
+        self.decreases = 0
+        self.failures = 0
+        self.rate_wait_seconds = 0.0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._bucket_lock = asyncio.Lock()
+        self._slots = asyncio.Condition()
+
+    async def _take_token(self) -> None:
+        if not self.rate:
+            return
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.rate_wait_seconds += wait
+                await asyncio.sleep(wait)
+
+    async def acquire(self) -> None:
+        async with self._slots:
+            await self._slots.wait_for(lambda: self.active < max(self.min_limit, int(self.limit)))
+            self.active += 1
+        await self._take_token()
+
+    async def release(self, failed: bool, elapsed: float) -> None:
+        self.active -= 1
+        if failed:
+            self.failures += 1
+        if self.adaptive:
+            now = time.monotonic()
+            if failed:
+                if now - self._last_decrease >= AIMD_DECREASE_COOLDOWN_SECONDS:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                    self.decreases += 1
+                    print(f"[ritmo] Errores/timeouts: baja a {int(self.limit)} consultas simultaneas.")
+            elif elapsed <= AIMD_FAST_SECONDS and self.limit < self.max_limit:
+                before = int(self.limit)
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                if int(self.limit) > before:
+                    self.increases += 1
+            self.lowest_limit = min(self.lowest_limit, self.limit)
+            self.highest_limit = max(self.highest_limit, self.limit)
+        async with self._slots:
+            self._slots.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "lowest_limit": int(self.lowest_limit),
+            "highest_limit": int(self.highest_limit),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "failures": self.failures,
+            "rate_wait_seconds": round(self.rate_wait_seconds, 2),
+        }
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Backoff exponencial con jitter para el reintento numero attempt (1, 2, ...).
+    """
+    base = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    return base * random.uniform(0.5, 1.5)
+
+
+async def fetch_amount_for_code(
+    context,
+    code: str,
+    url: str,
+    cache: "AmountCache | None" = None,
+    force_refresh: bool = False,
+    engine: str = DEFAULT_FETCH_ENGINE,
+    trace: "RowTrace | None" = None,
+    tab: "WarmTab | None" = None,
+    throttle: "FetchThrottle | None" = None,
+) -> int | None:
+    """
+    Devuelve el monto de Envíos de una venta, consultando primero la cache local.
+    Con force_refresh se ignora la cache pero el resultado nuevo igual se guarda.
+    Con engine="http" intenta primero sin pestaña y cae a la pagina si no resulta.
+    Si se entrega trace, se anotan los tiempos de cada fase y como se resolvio.
+    Con tab se navega la pestaña tibia del worker en vez de abrir una nueva.
+    Con throttle, solo las consultas de red (no los aciertos de cache) pasan por el limite
+    de tasa/concurrencia y le informan su resultado.
+    """
+    if cache is not None and not force_refresh:
+        with timed_phase(trace, "cache"):
+            cached = cache.get(code)
+        if cached is not None:
+            amount, source = cached
+            print(f"[{code}] Envíos ({source or 'sin dato'}, cache): {format_amount(amount)}")
+            if trace is not None:
+                trace.status, trace.source = "cache", source
+            return amount
+
+    if throttle is not None:
+        if trace is None:
+            trace = RowTrace()
+        await throttle.acquire()
+    started = time.perf_counter()
+    amount, source = None, None
+    try:
+        if engine == "http":
+            with timed_phase(trace, "http"):
+                amount, source = await fetch_amount_via_http(context, code, url)
+            if amount is None:
+                print(f"[{code}] Modo HTTP sin resultado, se usa la pagina completa.")
+            elif trace is not None:
+                trace.status = "http"
+        if amount is None:
+            amount, source = await fetch_amount_from_page(context, code, url, trace=trace, tab=tab)
+    finally:
+        if throttle is not None:
+            failed = amount is None and trace.status in ("timeout", "error", "closed")
+            await throttle.release(failed, time.perf_counter() - started)
+    if trace is not None:
+        trace.source = source
+    if cache is not None and amount is not None:
+        cache.put(code, amount, source)
+    return amount
+
+
+async def fetch_amount_from_page(
+    context, code: str, url: str, trace: "RowTrace | None" = None, tab: "WarmTab | None" = None
+) -> tuple[int | None, str | None]:
+    """
+    Abre el detalle en una pestaña (nueva, o la tibia del worker si hay tab) y devuelve
+    (monto, fuente). La fuente es "Envíos", "Bonificaciones" o None si no hubo ninguna fila.
+    """
+    if trace is not None:
+        trace.status = "page"
+    healthy = False
+    try:
+        with timed_phase(trace, "new_page"):
+            page = await tab.acquire() if tab is not None else await context.new_page()
+    except Exception as exc:
+        print(f"[{code}] No se pudo abrir una nueva pestaña: {exc}")
+        if trace is not None:
+            trace.status = "closed" if is_connection_error(exc) else "error"
+        return None, None
+
+    try:
+        page.set_default_timeout(20000)
+        with timed_phase(trace, "goto"):
+            await page.goto(url, wait_until="domcontentloaded")
+        if is_login_url(page.url):
+            # Sin sesion no tiene sentido esperar las filas hasta el timeout.
+            print(f"[{code}] Redirigido al login: la sesion vencio.")
+            healthy = True
+            if trace is not None:
+                trace.status = "login"
+            return None, None
+
+        rows = await extract_account_rows(page, trace=trace)
+        parsed, source = pick_shipping_amount(rows)
+        if trace is not None:
+            trace.fallback = source == "Bonificaciones"
+
+        healthy = True
+        if source is None:
+            print(f"[{code}] No se encontraron Envíos ni Bonificaciones. Valor: $ 0")
+            return 0, None
+
+        if parsed is None:
+            print(f"[{code}] No se pudo interpretar el valor de {source}: {dict(rows)}")
+            if trace is not None:
+                trace.status = "error"
+            return None, None
+
+        print(f"[{code}] Envíos ({source}): {format_amount(parsed)}")
+        return parsed, source
+    except PlaywrightTimeoutError:
+        print(f"[{code}] Timeout esperando datos. Revisa si hay login pendiente.")
+        if trace is not None:
+            trace.status = "timeout"
+        return None, None
+    except Exception as exc:
+        print(f"[{code}] Error extrayendo datos: {exc}")
+        if trace is not None:
+            trace.status = "closed" if is_connection_error(exc) else "error"
+        return None, None
+    finally:
+        with timed_phase(trace, "close"):
+            if tab is not None:
+                # Una pestaña que fallo puede quedar trabada: se reemplaza en el proximo codigo.
+                tab.release(healthy)
+            else:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+
+
+async def fetch_amount_via_http(context, code: str, url: str) -> tuple[int | None, str | None]:
+    """
+    Pide el detalle con context.request (comparte las cookies del perfil ml_profile) y
+    busca el subtotal en el HTML del servidor o en el estado JSON embebido, sin renderizar.
+    Devuelve (None, None) si no pudo resolverlo, para que el llamador use la pagina.
+    """
+    try:
+        response = await context.request.get(url, timeout=15000)
+    except Exception as exc:
+        print(f"[{code}] Error en modo HTTP: {exc}")
+        return None, None
+
+    try:
+        if not response.ok or is_login_url(response.url):
+            print(f"[{code}] Modo HTTP respondio {response.status} ({response.url}).")
+            return None, None
+        html = await response.text()
+    except Exception as exc:
+        print(f"[{code}] Error leyendo respuesta HTTP: {exc}")
+        return None, None
+    finally:
+        try:
+            await response.dispose()
+        except Exception:
+            pass
+
+    rows = parse_detail_html(html)
+    if not rows:
+        return None, None
+
+    amount, source = pick_shipping_amount(rows)
+    if amount is None:
+        return None, None
+    print(f"[{code}] Envíos ({source or 'sin dato'}, HTTP): {format_amount(amount)}")
+    return amount, source
+
+
+def is_connection_error(exc: BaseException) -> bool:
+    """
+    True si el error indica que la pestaña, el contexto o el Chrome ya no existen.
+    """
+    lowered = str(exc).lower()
+    return any(marker in lowered for marker in CONNECTION_ERROR_MARKERS)
+
+
+def context_alive(context) -> bool:
+    """
+    False si el Chrome del contexto se desconecto (los contextos persistentes no exponen
+    su browser: se asumen vivos y queda el corte por fallos seguidos).
+    """
+    browser = getattr(context, "browser", None)
+    return browser is None or browser.is_connected()
+
+
+def is_login_url(url: str) -> bool:
+    """
+    True si la URL (tras redirecciones) es la pantalla de login de MercadoLibre.
+    """
+    lowered = (url or "").lower()
+    return any(marker in lowered for marker in LOGIN_URL_MARKERS)
+
+
+async def check_session(context) -> str | None:
+    """
+    Sondeo rapido antes del loop: pide el listado con las cookies del contexto y devuelve
+    "login" si redirige al login, "captcha" si termina en una URL de desafio o en una pagina
+    con el contenedor del desafio en vez del listado, o None si la sesion parece valida.
+    Un error de red no bloquea la corrida (queda el corte por fallos).
+    """
+    try:
+        response = await context.request.get(LISTING_URL, timeout=SESSION_PROBE_TIMEOUT_MS)
+    except Exception as exc:
+        print(f"[sesion] No se pudo verificar la sesion: {exc}")
+        return None
+    try:
+        if is_login_url(response.url) or response.status in (401, 403):
+            return "login"
+        if any(marker in response.url.lower() for marker in CAPTCHA_URL_MARKERS):
+            return "captcha"
+        html = (await response.text()).lower()
+    except Exception as exc:
+        print(f"[sesion] No se pudo leer la respuesta: {exc}")
+        return None
+    finally:
+        try:
+            await response.dispose()
+        except Exception:
+            pass
+    if "__preloaded_state__" in html:
+        return None  # el listado se renderizo: la sesion sirve
+    if any(marker in html for marker in CAPTCHA_CONTAINER_MARKERS):
+        return "captcha"
+    return None
+
+
+async def harvest_listing(
+    context,
+    codes: set[str],
+    max_pages: int = DEFAULT_LISTING_MAX_PAGES,
+    cancel_event: threading.Event | None = None,
+) -> tuple[dict[str, tuple[int, str | None]], int]:
+    """
+    Recorre LISTING_URL pagina por pagina (HTTP con las cookies del contexto) y resuelve en
+    bloque los codigos cuyo Envíos/Bonificaciones viene en el estado embebido del listado.
+    Para cuando estan todos, cuando una pagina no trae ventas nuevas o al llegar a max_pages.
+    Devuelve ({codigo: (monto, fuente)}, paginas leidas); lo que falte va al detalle.
+    """
+    found: dict[str, tuple[int, str | None]] = {}
+    seen_ids: set[str] = set()
+    pages = 0
+    for page_number in range(1, max_pages + 1):
+        if len(found) == len(codes) or (cancel_event and cancel_event.is_set()):
+            break
+        url = f"{LISTING_URL}?{LISTING_PAGE_PARAM}={page_number}"
+        try:
+            response = await context.request.get(url, timeout=20000)
+        except Exception as exc:
+            print(f"[listado] Error pidiendo la pagina {page_number}: {exc}")
+            break
+        try:
+            if not response.ok or is_login_url(response.url):
+                print(f"[listado] La pagina {page_number} respondio {response.status} ({response.url}).")
+                break
+            html = await response.text()
+        except Exception as exc:
+            print(f"[listado] Error leyendo la pagina {page_number}: {exc}")
+            break
+        finally:
+            try:
+                await response.dispose()
+            except Exception:
+                pass
+
+        pages += 1
+        page_found, page_ids = parse_listing_html(html, codes)
+        new_ids = page_ids - seen_ids
+        if not new_ids:
+            break  # pagina vacia o la misma de antes: se acabo el listado
+        seen_ids |= new_ids
+        for code, value in page_found.items():
+            found.setdefault(code, value)
+        print(f"[listado] Pagina {page_number}: {len(new_ids)} ventas nuevas, {len(found)}/{len(codes)} codigos resueltos.")
+    return found, pages
+
+
+class BrowserService:
+    """
+    Hilo de fondo con su propio event loop que mantiene una instancia de Playwright y la
+    conexion CDP al Chrome del login. Los trabajos (corutinas) llegan con submit() desde
+    cualquier hilo y devuelven un concurrent.futures.Future. Si Chrome se cierra, se
+    reinicia o cambia el puerto, la proxima get_context() reconecta sola.
+    """
+
+    def __init__(self) -> None:
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._connect_lock: asyncio.Lock | None = None
+        self._playwright = None
+        self._browser = None
+        self._endpoint: str | None = None
+        self._managed_context = None
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name="browser-service", daemon=True)
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """
+        Programa la corutina en el loop del servicio (thread-safe).
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+
+    def _on_disconnected(self, _browser) -> None:
+        self._browser = None
+
+    async def _disconnect(self) -> None:
+        browser, self._browser = self._browser, None
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass
+
+    async def get_context(self, endpoint: str | None = None):
+        """
+        Devuelve el contexto del Chrome (re)conectando si hace falta. Sin endpoint se usa
+        el puerto del boton de login. Debe llamarse desde el loop del servicio.
+        """
+        async_playwright = await asyncio.to_thread(get_async_playwright)
+        if async_playwright is None:
+            raise RuntimeError("Falta Playwright. Instala con: pip install playwright && python -m playwright install")
+        if endpoint is None:
+            if REMOTE_DEBUG_PORT is None:
+                raise RuntimeError("No hay puerto de depuracion. Pulsa el boton de login primero.")
+            port = REMOTE_DEBUG_PORT
+            if not await asyncio.to_thread(wait_for_port, "localhost", port, 10, 0.4):
+                raise RuntimeError(f"No se pudo alcanzar el puerto {port}.")
+            endpoint = f"http://localhost:{port}"
+
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            browser = self._browser
+            if browser is not None and (endpoint != self._endpoint or not browser.is_connected()):
+                await self._disconnect()
+            if self._browser is None:
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                print(f"[cdp] Conectando a {endpoint}...")
+                browser = await self._playwright.chromium.connect_over_cdp(endpoint)
+                browser.on("disconnected", self._on_disconnected)
+                self._browser = browser
+                self._endpoint = endpoint
+            if not self._browser.contexts:
+                raise RuntimeError("No hay contextos en Chrome. ¿Cerraste la ventana de login?")
+            return self._browser.contexts[0]
+
+    def _on_managed_closed(self, _context) -> None:
+        self._managed_context = None
+
+    async def get_managed_context(self, profile_dir: Path = AUTOMATION_PROFILE_DIR):
+        """
+        Como get_context, pero con un Chrome headless propio sobre el perfil del login
+        (launch_managed_context). Se abre la primera vez y queda vivo para las siguientes.
+        """
+        async_playwright = await asyncio.to_thread(get_async_playwright)
+        if async_playwright is None:
+            raise RuntimeError("Falta Playwright. Instala con: pip install playwright && python -m playwright install")
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._managed_context is None:
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                context = await launch_managed_context(self._playwright, profile_dir)
+                context.on("close", self._on_managed_closed)
+                self._managed_context = context
+            return self._managed_context
+
+
+_BROWSER_SERVICE: BrowserService | None = None
+
+
+def prewarm_browser_service() -> concurrent.futures.Future:
+    """
+    Deja BrowserService conectado al Chrome del login (importa Playwright, arranca su driver
+    y abre la conexion CDP) sin esperar al primer "Procesar Excel", que luego la reutiliza.
+    """
+    service = get_browser_service()
+    started = time.perf_counter()
+
+    async def warm() -> bool:
+        try:
+            await service.get_context()
+        except Exception as exc:
+            print(f"[cdp] No se pudo pre-conectar: {exc}")
+            return False
+        print(f"[cdp] Conexion lista en segundo plano en {time.perf_counter() - started:.2f}s.")
+        return True
+
+    return service.submit(warm())
+
+
+def get_browser_service() -> BrowserService:
+    global _BROWSER_SERVICE
+    if _BROWSER_SERVICE is None:
+        _BROWSER_SERVICE = BrowserService()
+    return _BROWSER_SERVICE
+
+
+def find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(host: str, port: int, attempts: int = 15, delay: float = 0.4) -> bool:
+    for _ in range(attempts):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.settimeout(delay)
+            if sock.connect_ex((host, port)) == 0:
+                return True
+        time.sleep(delay)
+    return False
+
+
+def show_error(title: str, message: str) -> None:
+    """
+    Muestra el error en un messagebox si la GUI esta activa; en modo consola solo lo imprime.
+    """
+    print(f"[error] {title}: {message}")
+    if "tkinter" in sys.modules:
+        from tkinter import messagebox
+
+        messagebox.showerror(title, message)
+
+
+def start_login_browser(start_url: str = LOGIN_URL, profile_dir: Path = AUTOMATION_PROFILE_DIR) -> bool:
+    """
+    Lanza Chrome normal (sin banderas de automatizacion) con remote debugging para que el usuario
+    haga login y guarde cookies en ./ml_profile. Mantiene el puerto en REMOTE_DEBUG_PORT.
+    """
+    global REMOTE_DEBUG_PORT, CHROME_PROCESS
+
+    chrome_exe = find_chrome_executable()
+    if not chrome_exe:
+        show_error(
             "Chrome no encontrado",
             "No se encontro Google Chrome en las rutas tipicas. Ajusta la ruta en el codigo.",
         )
-        return
+        return False
 
     REMOTE_DEBUG_PORT = find_free_port()
-    AUTOMATION_PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    profile_dir = Path(profile_dir)
+    profile_dir.mkdir(parents=True, exist_ok=True)
 
     args = [
         chrome_exe,
         f"--remote-debugging-port={REMOTE_DEBUG_PORT}",
-        f"--user-data-dir={AUTOMATION_PROFILE_DIR}",
+        f"--user-data-dir={profile_dir}",
         "--profile-directory=Default",
         "--start-maximized",
         "--no-default-browser-check",
@@ -702,36 +3109,429 @@ def start_login_browser(start_url: str = LOGIN_URL) -> None:
         )
     except Exception as exc:
         print(f"[login] No se pudo lanzar Chrome: {exc}")
-        return
+        return False
 
     if wait_for_port("localhost", REMOTE_DEBUG_PORT):
         print(
             f"[login] Chrome abierto en {start_url}. Puerto CDP {REMOTE_DEBUG_PORT}. "
-            "Inicia sesion; las cookies se guardan en ./ml_profile."
+            f"Inicia sesion; las cookies se guardan en {profile_dir}."
         )
-    else:
-        print("[login] No se pudo confirmar el puerto de depuracion. Reintenta.")
+        return True
+    print("[login] No se pudo confirmar el puerto de depuracion. Reintenta.")
+    return False
+
+
+def has_saved_login(profile_dir: Path = AUTOMATION_PROFILE_DIR) -> bool:
+    """
+    True si el perfil ya tiene cookies guardadas (hubo al menos un login interactivo).
+    """
+    default = Path(profile_dir) / "Default"
+    return (default / "Network" / "Cookies").is_file() or (default / "Cookies").is_file()
 
 
-async def extract_amount_text(
-    page, title: str, timeout_ms: int = 15000, fast_fail: bool = False
-) -> str | None:
+async def launch_managed_context(playwright, profile_dir: Path = AUTOMATION_PROFILE_DIR, headless: bool = True):
     """
-    Intenta obtener el texto del subtotal para una fila con el titulo dado.
+    Abre un contexto persistente de Playwright sobre el perfil del login (por defecto sin
+    ventana), sin depender del Chrome visible de start_login_browser. Usa el Chrome/Chromium
+    del sistema si lo encuentra y si no el Chromium de Playwright. El perfil no puede estar
+    abierto en otra ventana de Chrome al mismo tiempo.
     """
+    profile_dir = Path(profile_dir)
+    if not has_saved_login(profile_dir):
+        raise RuntimeError(
+            f"El perfil {profile_dir} no tiene sesion guardada. Inicia sesion una vez con el boton de login."
+        )
+    print(f"[managed] Abriendo Chrome {'headless' if headless else 'con ventana'} sobre {profile_dir}...")
+    return await playwright.chromium.launch_persistent_context(
+        str(profile_dir),
+        executable_path=find_chrome_executable(),
+        headless=headless,
+        args=["--profile-directory=Default", "--no-default-browser-check", "--no-first-run"],
+        ignore_default_args=["--enable-automation"],
+    )
+
+
+def clone_profile(source: Path, target: Path) -> Path:
+    """
+    Copia el perfil del login (sin locks ni caches) para el Chrome de un shard. Si target
+    no se puede borrar (un Chrome de una corrida anterior sigue usandolo), copia a un
+    directorio nuevo junto a el. Devuelve el directorio usado.
+    """
+    if target.exists():
+        shutil.rmtree(target, ignore_errors=True)
+    if target.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target = Path(tempfile.mkdtemp(prefix=f"{target.name}_", dir=target.parent))
+        print(f"[shards] No se pudo limpiar el perfil anterior; se usa {target}.")
+    shutil.copytree(source, target, ignore=shutil.ignore_patterns(*PROFILE_CLONE_IGNORE), dirs_exist_ok=True)
+    return target
+
+
+class ShardFleet:
+    """
+    count navegadores Chrome, cada uno sobre una copia del perfil del login y con su propio
+    puerto CDP (find_free_port/wait_for_port). process_excel reparte los codigos unicos
+    entre sus contextos y junta los montos en un solo libro. Conviene cerrar la ventana de
+    login antes de clonar para que la copia de las cookies quede consistente.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        profile_dir: Path = AUTOMATION_PROFILE_DIR,
+        headless: bool = True,
+        root: Path = SHARD_PROFILES_DIR,
+    ) -> None:
+        self.count = max(1, count)
+        self.profile_dir = Path(profile_dir)
+        self.headless = headless
+        self.root = Path(root)
+        self.processes: list[subprocess.Popen] = []
+        self.endpoints: list[str] = []
+
+    def start(self) -> list[str]:
+        chrome_exe = find_chrome_executable()
+        if not chrome_exe:
+            raise RuntimeError("No se encontro Google Chrome/Chromium para los shards.")
+        if not has_saved_login(self.profile_dir):
+            raise RuntimeError(
+                f"El perfil {self.profile_dir} no tiene sesion guardada. Inicia sesion una vez con el boton de login."
+            )
+        try:
+            for index in range(self.count):
+                shard_dir = clone_profile(self.profile_dir, self.root / f"shard_{index + 1}")
+                port = find_free_port()
+                args = [
+                    chrome_exe,
+                    f"--remote-debugging-port={port}",
+                    f"--user-data-dir={shard_dir}",
+                    "--profile-directory=Default",
+                    "--no-default-browser-check",
+                    "--no-first-run",
+                ]
+                if self.headless:
+                    args.append("--headless=new")
+                self.processes.append(subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+                if not wait_for_port("localhost", port):
+                    raise RuntimeError(f"El shard {index + 1} no abrio el puerto {port}.")
+                self.endpoints.append(f"http://localhost:{port}")
+                print(f"[shards] Shard {index + 1}/{self.count} listo en el puerto {port}.")
+        except (OSError, shutil.Error) as exc:
+            self.close()
+            raise RuntimeError(f"No se pudieron preparar los shards: {exc}") from exc
+        except Exception:
+            self.close()
+            raise
+        return self.endpoints
+
+    async def connect(self, playwright) -> list:
+        contexts = []
+        for endpoint in self.endpoints:
+            browser = await playwright.chromium.connect_over_cdp(endpoint)
+            if not browser.contexts:
+                raise RuntimeError(f"El Chrome de {endpoint} no tiene contextos.")
+            contexts.append(browser.contexts[0])
+        return contexts
+
+    def close(self) -> None:
+        """
+        Termina los Chrome de los shards y espera a que salgan (kill si no responden).
+        """
+        for process in self.processes:
+            try:
+                process.terminate()
+            except Exception:
+                pass
+        deadline = time.monotonic() + SHARD_STOP_TIMEOUT_SECONDS
+        for process in self.processes:
+            try:
+                process.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                try:
+                    process.wait(timeout=SHARD_STOP_TIMEOUT_SECONDS)
+                except subprocess.TimeoutExpired:
+                    print(f"[shards] El proceso {process.pid} no termino.")
+            except Exception:
+                pass
+        self.processes = []
+
+    def remove_profiles(self) -> None:
+        """
+        Borra las copias del perfil (tienen las cookies de la sesion). Las que sigan en uso
+        por un Chrome que no termino quedan para la proxima corrida.
+        """
+        if not self.root.is_dir():
+            return
+        for shard_dir in self.root.glob("shard_*"):
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+async def run_with_shards(job, shards: int, profile_dir: Path = AUTOMATION_PROFILE_DIR, headless: bool = True):
+    """
+    Levanta una ShardFleet, ejecuta job(contexts) con un contexto por shard y la cierra.
+    """
+    async_playwright = await asyncio.to_thread(get_async_playwright)
+    if async_playwright is None:
+        raise RuntimeError("Falta Playwright. Instala con: pip install playwright && python -m playwright install")
+    fleet = ShardFleet(shards, profile_dir, headless=headless)
     try:
-        row = page.locator("div.sc-account-rows__row", has_text=title).first
-        if fast_fail:
-            if await row.count() == 0:
-                return None
-        else:
-            await row.wait_for(state="attached", timeout=timeout_ms)
-        text = await row.locator("span.sc-account-rows__row__subTotal").first.text_content()
-        return text.strip() if text else None
-    except PlaywrightTimeoutError:
-        return None
+        await asyncio.to_thread(fleet.start)
+        playwright = await async_playwright().start()
+        try:
+            return await job(await fleet.connect(playwright))
+        finally:
+            try:
+                await playwright.stop()
+            except Exception:
+                pass
+    finally:
+        await asyncio.to_thread(fleet.close)
+        await asyncio.to_thread(fleet.remove_profiles)
+
+
+async def run_with_managed_context(job, profile_dir: Path = AUTOMATION_PROFILE_DIR, headless: bool = True):
+    """
+    Ejecuta job(context) con un contexto administrado y lo cierra al terminar.
+    """
+    async_playwright = await asyncio.to_thread(get_async_playwright)
+    if async_playwright is None:
+        raise RuntimeError("Falta Playwright. Instala con: pip install playwright && python -m playwright install")
+    playwright = await async_playwright().start()
+    try:
+        context = await launch_managed_context(playwright, profile_dir, headless=headless)
+        try:
+            return await job(context)
+        finally:
+            try:
+                await context.close()
+            except Exception:
+                pass
+    finally:
+        try:
+            await playwright.stop()
+        except Exception:
+            pass
+
+
+ACCOUNT_ROW_SELECTOR = "div.sc-account-rows__row"
+ACCOUNT_SUBTOTAL_SELECTOR = "div.sc-account-rows__row span.sc-account-rows__row__subTotal"
+ACCOUNT_ROWS_TIMEOUT_MS = 10000
+# Sin fila de Envíos en la primera lectura se espera a que la cantidad de filas no cambie
+# entre dos sondeos (la SPA puede ir pintandolas de a una) antes de leer de nuevo.
+ACCOUNT_ROWS_SETTLE_MS = 150
+ACCOUNT_ROWS_SETTLE_TIMEOUT_MS = 3000
+_ACCOUNT_ROWS_SETTLED_JS = """
+selector => {
+    const count = document.querySelectorAll(selector).length;
+    const settled = count > 0 && window.__envios_row_count === count;
+    window.__envios_row_count = count;
+    return settled;
+}
+"""
+# Lee todas las filas en una sola ida y vuelta: [titulo sin el subtotal, subtotal].
+_ACCOUNT_ROWS_JS = """
+rows => rows.map(row => {
+    const sub = row.querySelector("span.sc-account-rows__row__subTotal");
+    const subtotal = sub ? sub.textContent.trim() : "";
+    let title = row.textContent || "";
+    if (sub) title = title.replace(sub.textContent, "");
+    return [title.replace(/\\s+/g, " ").trim(), subtotal];
+}).filter(pair => pair[1])
+"""
+
+
+async def extract_account_rows(
+    page, timeout_ms: int = ACCOUNT_ROWS_TIMEOUT_MS, trace: "RowTrace | None" = None
+) -> list[tuple[str, str]]:
+    """
+    Espera a que haya una fila sc-account-rows con subtotal y devuelve todos los pares
+    (titulo, subtotal) en una sola llamada. Si esa lectura no trae Envíos, espera a que la
+    cantidad de filas se estabilice y lee otra vez, para no tomar un $ 0 de una pagina a
+    medio pintar. La prioridad Envíos -> Bonificaciones se elige despues en Python
+    (pick_shipping_amount). Si no aparece ninguna fila se propaga el timeout.
+    """
+    with timed_phase(trace, "wait_rows"):
+        await page.wait_for_selector(ACCOUNT_SUBTOTAL_SELECTOR, state="attached", timeout=timeout_ms)
+    with timed_phase(trace, "extract"):
+        pairs = await page.eval_on_selector_all(ACCOUNT_ROW_SELECTOR, _ACCOUNT_ROWS_JS)
+    primary = AMOUNT_TITLES[0].lower()
+    if not any(primary in str(title).lower() for title, _ in pairs):
+        with timed_phase(trace, "settle_rows"):
+            try:
+                await page.wait_for_function(
+                    _ACCOUNT_ROWS_SETTLED_JS,
+                    arg=ACCOUNT_ROW_SELECTOR,
+                    polling=ACCOUNT_ROWS_SETTLE_MS,
+                    timeout=ACCOUNT_ROWS_SETTLE_TIMEOUT_MS,
+                )
+            except PlaywrightTimeoutError:
+                pass  # las filas siguen cambiando: se usa lo que haya ahora
+            pairs = await page.eval_on_selector_all(ACCOUNT_ROW_SELECTOR, _ACCOUNT_ROWS_JS)
+    return [(str(title), str(subtotal)) for title, subtotal in pairs]
+
+
+class _AccountRowsParser(HTMLParser):
+    """
+    Recorre el HTML y junta pares (titulo, subtotal) de cada div.sc-account-rows__row.
+    El fin de la fila se busca contando solo <div>: una etiqueta sin cierre dentro de la
+    fila (p. ej. un <p> abierto) no la corta ni arrastra el resto de la pagina.
+    """
+
+    VOID_TAGS = ("br", "img", "input", "meta", "link", "hr", "source", "wbr", "col", "area", "embed")
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.rows: list[tuple[str, str]] = []
+        self._row_divs = 0
+        self._row_text: list[str] = []
+        self._subtotal_tag: str | None = None
+        self._subtotal_nesting = 0
+        self._subtotal_text: list[str] = []
+
+    def handle_starttag(self, tag, attrs) -> None:
+        classes = (dict(attrs).get("class") or "").split()
+        if not self._row_divs:
+            if tag == "div" and "sc-account-rows__row" in classes:
+                self._row_divs = 1
+                self._row_text = []
+                self._subtotal_text = []
+                self._subtotal_tag = None
+            return
+        if tag == "div":
+            self._row_divs += 1
+        if self._subtotal_tag is not None:
+            self._subtotal_nesting += tag == self._subtotal_tag
+        elif "sc-account-rows__row__subTotal" in classes and tag not in self.VOID_TAGS:
+            self._subtotal_tag = tag
+            self._subtotal_nesting = 1
+
+    def handle_endtag(self, tag) -> None:
+        if not self._row_divs:
+            return
+        if tag == self._subtotal_tag:
+            self._subtotal_nesting -= 1
+            if not self._subtotal_nesting:
+                self._subtotal_tag = None
+        if tag != "div":
+            return
+        self._row_divs -= 1
+        if not self._row_divs:
+            title = " ".join("".join(self._row_text).split())
+            subtotal = " ".join("".join(self._subtotal_text).split())
+            if subtotal:
+                self.rows.append((title, subtotal))
+            self._subtotal_tag = None
+
+    def handle_data(self, data) -> None:
+        if self._subtotal_tag is not None:
+            self._subtotal_text.append(data)
+        elif self._row_divs:
+            self._row_text.append(data)
+
+
+_PRELOADED_STATE_RE = re.compile(r"__PRELOADED_STATE__\s*=\s*(\{.*?\})\s*;?\s*</script>", re.S)
+
+
+def _rows_from_state(node, rows: list[tuple[str, str]]) -> None:
+    if isinstance(node, dict):
+        title = node.get("title") or node.get("label") or node.get("text")
+        if isinstance(title, str) and any(t.lower() in title.lower() for t in AMOUNT_TITLES):
+            for key in ("subTotal", "subtotal", "amount", "value", "total"):
+                value = node.get(key)
+                if isinstance(value, dict):
+                    value = value.get("text") or value.get("amount") or value.get("value")
+                if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                    rows.append((title, str(value)))
+                    break
+        for child in node.values():
+            _rows_from_state(child, rows)
+    elif isinstance(node, list):
+        for child in node:
+            _rows_from_state(child, rows)
+
+
+def parse_detail_html(html: str) -> list[tuple[str, str]]:
+    """
+    Extrae los pares (titulo, subtotal) del HTML del detalle de venta.
+    Usa el markup sc-account-rows si viene renderizado en servidor; si no, busca las
+    filas en el estado JSON embebido (__PRELOADED_STATE__).
+    """
+    parser = _AccountRowsParser()
+    try:
+        parser.feed(html)
+        parser.close()
     except Exception:
-        return None
+        pass
+    if parser.rows:
+        return parser.rows
+
+    rows: list[tuple[str, str]] = []
+    match = _PRELOADED_STATE_RE.search(html)
+    if match:
+        try:
+            _rows_from_state(json.loads(match.group(1)), rows)
+        except ValueError:
+            pass
+    return rows
+
+
+def parse_listing_html(html: str, codes: set[str]) -> tuple[dict[str, tuple[int, str | None]], set[str]]:
+    """
+    Busca en el __PRELOADED_STATE__ del listado los nodos de venta (LISTING_ID_KEYS) y, para
+    los codigos pedidos, arma sus filas Envíos/Bonificaciones como en el detalle. Devuelve
+    ({codigo: (monto, fuente)}, todos los ids de venta vistos en la pagina).
+    """
+    found: dict[str, tuple[int, str | None]] = {}
+    seen: set[str] = set()
+    match = _PRELOADED_STATE_RE.search(html)
+    if not match:
+        return found, seen
+    try:
+        state = json.loads(match.group(1))
+    except ValueError:
+        return found, seen
+
+    def walk(node) -> None:
+        if isinstance(node, dict):
+            for key in LISTING_ID_KEYS:
+                value = node.get(key)
+                if isinstance(value, (str, int)) and not isinstance(value, bool):
+                    code = normalize_sale_code(value)
+                    seen.add(code)
+                    if code in codes and code not in found:
+                        rows: list[tuple[str, str]] = []
+                        _rows_from_state(node, rows)
+                        if rows:
+                            amount, source = pick_shipping_amount(rows)
+                            if amount is not None:
+                                found[code] = (amount, source)
+                    break
+            for child in node.values():
+                walk(child)
+        elif isinstance(node, list):
+            for child in node:
+                walk(child)
+
+    walk(state)
+    return found, seen
+
+
+def pick_shipping_amount(rows: list[tuple[str, str]]) -> tuple[int | None, str | None]:
+    """
+    Aplica la prioridad Envíos -> Bonificaciones sobre las filas (titulo, subtotal).
+    Devuelve (0, None) si no hay ninguna de las dos y (None, fuente) si el texto no se entiende.
+    Los montos negativos (cargos) se reportan como 0, igual que en la pagina.
+    """
+    for title in AMOUNT_TITLES:
+        for row_title, subtotal in rows:
+            if title.lower() not in row_title.lower():
+                continue
+            parsed = parse_amount(subtotal)
+            if parsed is None:
+                return None, title
+            return max(parsed, 0), title
+    return 0, None
 
 
 def parse_amount(text: str) -> int | None:
@@ -754,6 +3554,36 @@ def parse_amount(text: str) -> int | None:
     return value
 
 
+# Rango de array("q") de ReportColumns: un numero mas grande no es un monto (p. ej. una
+# referencia con muchos digitos) y se trata como ilegible.
+_AMOUNT_LIMIT = 2**63 - 1
+
+
+def normalize_amounts(values: list) -> list[int]:
+    """
+    parse_amount sobre una columna entera; los vacios, ilegibles o fuera de rango quedan en 0.
+    """
+    amounts: list[int] = []
+    append = amounts.append
+    for value in values:
+        amount = value if value.__class__ is int else parse_amount(value)
+        if amount is None or not -_AMOUNT_LIMIT <= amount <= _AMOUNT_LIMIT:
+            amount = 0
+        append(amount)
+    return amounts
+
+
+def normalize_sale_code(value) -> str:
+    """
+    Normaliza un codigo de venta leido del Excel ("  123 ", 123 o 123.0 -> "123").
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
 def format_amount(value: int) -> str:
     """
     Devuelve una cadena tipo "$ 3.090" con separador de miles usando punto.
@@ -761,5 +3591,243 @@ def format_amount(value: int) -> str:
     return "$ " + f"{value:,}".replace(",", ".")
 
 
+def build_cli_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="app.py",
+        description="Procesa reportes de MercadoLibre/Walmart sin abrir la ventana (modo consola).",
+    )
+    parser.add_argument("inputs", nargs="+", help="Excel(s) con la hoja Reporte")
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Archivo de salida (un solo Excel) o carpeta donde dejar los *_con_envios.xlsx",
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Pestañas en paralelo")
+    parser.add_argument("--cdp-endpoint", help="Chrome ya abierto, p. ej. http://localhost:9222")
+    parser.add_argument(
+        "--profile-dir",
+        type=Path,
+        default=AUTOMATION_PROFILE_DIR,
+        help="Perfil con la sesion iniciada si no se indica --cdp-endpoint (por defecto ./ml_profile)",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Abrir Chrome sin ventana sobre el perfil (requiere un login previo con la GUI)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Navegadores en paralelo, cada uno con una copia del perfil y su puerto CDP",
+    )
+    parser.add_argument("--engine", choices=FETCH_ENGINES, default=DEFAULT_FETCH_ENGINE)
+    parser.add_argument("--block-resources", action="store_true", help="Bloquear imagenes/analitica")
+    parser.add_argument("--no-cache", action="store_true", help="No leer ni escribir la cache local")
+    parser.add_argument("--force-refresh", action="store_true", help="Ignorar la cache y reconsultar todo")
+    parser.add_argument(
+        "--cache-ttl-days",
+        type=float,
+        default=DEFAULT_CACHE_TTL_SECONDS / 86400,
+        help="Antiguedad maxima de la cache en dias",
+    )
+    parser.add_argument(
+        "--tab-max-uses",
+        type=int,
+        default=DEFAULT_TAB_MAX_USES,
+        help="Codigos por pestaña antes de renovarla (0 = pestaña nueva por codigo)",
+    )
+    parser.add_argument(
+        "--listing",
+        action="store_true",
+        help="Resolver primero en bloque desde el listado omni y solo el resto por detalle",
+    )
+    parser.add_argument(
+        "--listing-max-pages",
+        type=int,
+        default=DEFAULT_LISTING_MAX_PAGES,
+        help="Paginas maximas del listado a recorrer",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="Codigos que cada worker navega por adelantado mientras lee el actual",
+    )
+    parser.add_argument(
+        "--no-session-check",
+        action="store_true",
+        help="No verificar la sesion (login/captcha) antes de consultar",
+    )
+    parser.add_argument(
+        "--breaker",
+        type=int,
+        default=DEFAULT_BREAKER_THRESHOLD,
+        help="Detener tras N timeouts o redirecciones a login seguidos (0 = nunca)",
+    )
+    parser.add_argument(
+        "--memory-watchdog",
+        action="store_true",
+        help="Vigilar la memoria de Chrome, renovar pestañas y guardar la linea de tiempo",
+    )
+    parser.add_argument(
+        "--memory-limit-mb",
+        type=float,
+        default=DEFAULT_MEMORY_LIMIT_MB,
+        help="RSS total de Chrome a partir del cual se renuevan las pestañas",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help="Reintentos con backoff por codigo fallido",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="Maximo de consultas de detalle por segundo",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Ajustar las pestañas en paralelo segun timeouts y errores (AIMD)",
+    )
+    parser.add_argument(
+        "--results",
+        choices=("jsonl", "csv"),
+        help="Ir escribiendo cada fila resuelta en un archivo de resultados junto a la salida",
+    )
+    parser.add_argument(
+        "--timing",
+        choices=("jsonl", "csv"),
+        help="Guardar tiempos por fase de cada codigo y un resumen junto a la salida",
+    )
+    return parser
+
+
+def run_cli(argv: list[str]) -> int:
+    """
+    Modo consola: mismo process_excel que la GUI, sin tkinter. Varios archivos o carpetas se
+    procesan como lote con una sola conexion. Los logs van a stderr y el resumen sale como
+    una linea JSON en stdout; el avance (filas/s, ETA) se imprime cada PROGRESS_LOG_SECONDS.
+    Codigos de salida: 0 ok, 1 error, 2 cancelado, 3 sesion vencida (hay que volver a loguear),
+    4 incompleto (codigos sin dato tras los reintentos, quedan en blanco).
+    """
+    args = build_cli_parser().parse_args(argv)
+    files = expand_report_paths(args.inputs)
+    output_is_dir = bool(args.output) and Path(args.output).is_dir()
+    if args.output and not output_is_dir and len(files) != 1:
+        print("--output debe ser una carpeta existente cuando hay varios archivos.", file=sys.stderr)
+        return 1
+    if not files:
+        print("No hay archivos .xlsx para procesar.", file=sys.stderr)
+        return 1
+
+    cancel_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: cancel_event.set())
+
+    options = {
+        "concurrency": max(1, min(args.concurrency, MAX_CONCURRENCY)),
+        "use_cache": not args.no_cache,
+        "cache_ttl": args.cache_ttl_days * 86400,
+        "force_refresh": args.force_refresh,
+        "block_resources": args.block_resources,
+        "engine": args.engine,
+        "timing_format": args.timing,
+        "results_format": args.results,
+        "tab_max_uses": args.tab_max_uses,
+        "max_retries": max(0, args.max_retries),
+        "session_check": not args.no_session_check,
+        "breaker_threshold": max(0, args.breaker),
+        "memory_watchdog": args.memory_watchdog,
+        "memory_limit_mb": args.memory_limit_mb,
+        "prefetch": max(0, args.prefetch),
+        "listing_harvest": args.listing,
+        "listing_max_pages": max(1, args.listing_max_pages),
+        "rate_limit": args.rate_limit,
+        "adaptive_concurrency": args.adaptive,
+    }
+    progress = ProgressState()
+    options["progress"] = progress
+    summary: dict = {}
+    launched_chrome = False
+    with contextlib.redirect_stdout(sys.stderr):
+        endpoint = args.cdp_endpoint
+        if endpoint is None and not args.headless and args.shards <= 1:
+            if start_login_browser(profile_dir=args.profile_dir):
+                launched_chrome = True
+                endpoint = f"http://localhost:{REMOTE_DEBUG_PORT}"
+            else:
+                summary = {"status": "error", "error": "No se pudo abrir Chrome con el perfil.", "files": []}
+
+        ready = bool(endpoint) or args.headless or args.shards > 1
+
+        def run_job(make_job) -> None:
+            # Con --shards se levantan N Chrome sobre copias del perfil; con --headless el
+            # contexto lo abre Playwright sobre el perfil; si no, se usa CDP.
+            if args.shards > 1:
+                asyncio.run(
+                    run_with_shards(lambda contexts: make_job(contexts=contexts), args.shards, args.profile_dir)
+                )
+            elif args.headless:
+                asyncio.run(
+                    run_with_managed_context(lambda context: make_job(context=context), args.profile_dir)
+                )
+            else:
+                asyncio.run(make_job(cdp_endpoint=endpoint))
+
+        try:
+            with progress_log(progress):
+                if ready and args.output and not output_is_dir:
+                    last_status: list[str] = [""]
+                    file_summary: dict = {}
+
+                    def single_status(message: str) -> None:
+                        last_status[0] = message
+                        progress.set_status(message)
+
+                    run_job(
+                        lambda **connection: process_excel(
+                            str(files[0]),
+                            on_progress=progress.set_progress,
+                            on_status=single_status,
+                            on_summary=file_summary.update,
+                            cancel_event=cancel_event,
+                            output_path=args.output,
+                            **connection,
+                            **options,
+                        )
+                    )
+                    if not file_summary:
+                        file_summary = {"status": "error", "input": str(files[0]), "error": last_status[0]}
+                    summary = {"status": file_summary["status"], "files": [file_summary]}
+                elif ready:
+                    run_job(
+                        lambda **connection: process_batch(
+                            files,
+                            on_progress=progress.set_progress,
+                            on_status=progress.set_status,
+                            cancel_event=cancel_event,
+                            output_dir=args.output,
+                            on_summary=summary.update,
+                            **connection,
+                            **options,
+                        )
+                    )
+        except Exception as exc:
+            print(f"[cli] {exc}")
+            summary = {"status": "error", "error": str(exc), "files": []}
+        finally:
+            if launched_chrome and CHROME_PROCESS is not None:
+                CHROME_PROCESS.terminate()
+
+    if not summary:
+        summary = {"status": "error", "error": "No se pudo conectar a Chrome.", "files": []}
+    print(json.dumps(summary, ensure_ascii=False))
+    return {"ok": 0, "cancelled": 2, "relogin_required": 3, "incomplete": 4}.get(summary["status"], 1)
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     main()
@@ -0,0 +1,357 @@
+"""
+Benchmark offline de process_excel.
+
+Levanta un servidor HTTP local que imita /ventas/{code}/detalle con el mismo markup
+(div.sc-account-rows__row / span.sc-account-rows__row__subTotal), genera un Reporte
+sintetico con filas mercadolibre/walmart y corre process_excel contra Chromium headless
+(lanzado por Playwright) sin salir a internet. Reporta filas/s, percentiles de latencia
+por codigo y memoria maxima.
+
+    python benchmark.py --rows 2000 --concurrency 1 4 8 --latency-ms 150 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import app
+
+REPORT_COLUMNS = 25  # A..Y: W precio, X envio, Y total
+
+
+class FakeDetailConfig:
+    """
+    Comportamiento del servidor falso. Las tasas son probabilidades por request.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 120.0,
+        jitter_ms: float = 40.0,
+        render_delay_ms: float = 0.0,
+        missing_rate: float = 0.05,
+        bonus_rate: float = 0.1,
+        error_rate: float = 0.0,
+        seed: int = 7,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.render_delay_ms = render_delay_ms
+        self.missing_rate = missing_rate
+        self.bonus_rate = bonus_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+
+def expected_rows(code: str, config: FakeDetailConfig) -> list[tuple[str, str]]:
+    """
+    Filas (titulo, subtotal) deterministas por codigo, para poder verificar la salida.
+    """
+    digest = int(hashlib.sha256(code.encode()).hexdigest(), 16)
+    bucket = (digest % 1000) / 1000
+    amount = 1000 + digest % 9000
+    rows = [("Precio del producto", app.format_amount(20000 + digest % 50000))]
+    if bucket < config.missing_rate:
+        return rows
+    if bucket < config.missing_rate + config.bonus_rate:
+        rows.append(("Bonificaciones", app.format_amount(amount)))
+    else:
+        rows.append(("Envíos", app.format_amount(amount)))
+    return rows
+
+
+def render_detail_page(rows: list[tuple[str, str]], render_delay_ms: float) -> str:
+    markup = "".join(
+        '<div class="sc-account-rows__row">'
+        f'<span class="sc-account-rows__row__title">{title}</span>'
+        f'<span class="sc-account-rows__row__subTotal">{subtotal}</span>'
+        "</div>"
+        for title, subtotal in rows
+    )
+    if render_delay_ms <= 0:
+        body = f'<div class="sc-account-rows">{markup}</div>'
+    else:
+        # Imita la SPA: las filas aparecen despues de un rato, no vienen en el HTML inicial.
+        body = (
+            '<div class="sc-account-rows" id="rows"></div>'
+            f"<script>setTimeout(function(){{document.getElementById('rows').innerHTML="
+            f"{json.dumps(markup)};}}, {int(render_delay_ms)});</script>"
+        )
+    return f'<!doctype html><html><head><meta charset="utf-8"></head><body>{body}</body></html>'
+
+
+def start_fake_server(config: FakeDetailConfig) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802 - nombre impuesto por BaseHTTPRequestHandler
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 3 or parts[0] != "ventas" or parts[2] != "detalle":
+                self.send_error(404)
+                return
+            with config.lock:
+                config.requests += 1
+                delay = max(0.0, config.random.gauss(config.latency_ms, config.jitter_ms)) / 1000
+                fail = config.random.random() < config.error_rate
+                if fail:
+                    config.errors += 1
+            time.sleep(delay)
+            if fail:
+                self.send_error(500)
+                return
+            payload = render_detail_page(expected_rows(parts[1], config), config.render_delay_ms).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def generate_report(
+    path: Path,
+    rows: int,
+    ml_share: float = 0.8,
+    repeat_share: float = 0.15,
+    seed: int = 11,
+) -> None:
+    """
+    Escribe un Excel con hoja Reporte: F canal, H codigo, W precio y X/Y vacias.
+    repeat_share es la fraccion de filas ML que repiten un codigo (ordenes multi-item).
+    """
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Reporte")
+    header = [f"Col{idx}" for idx in range(1, REPORT_COLUMNS + 1)]
+    header[5], header[7], header[22], header[23], header[24] = "Canal", "Venta", "Precio", "Envio", "Total"
+    ws.append(header)
+
+    ml_codes: list[str] = []
+    walmart_code = 0
+    walmart_left = 0
+    for _ in range(rows):
+        values: list = [None] * REPORT_COLUMNS
+        price = rng.randint(5, 90) * 1000
+        if rng.random() < ml_share:
+            if ml_codes and rng.random() < repeat_share:
+                code = rng.choice(ml_codes)
+            else:
+                code = str(2000000000 + rng.randint(0, 10**9))
+                ml_codes.append(code)
+            values[5], values[7] = "mercadolibre", code
+        else:
+            if walmart_left == 0:
+                walmart_code += 1
+                walmart_left = rng.randint(1, 3)
+            walmart_left -= 1
+            values[5], values[7] = "walmart", f"W{walmart_code}"
+            values[24] = price + rng.randint(0, 5) * 1000
+        values[22] = app.format_amount(price)
+        ws.append(values)
+    wb.save(path)
+
+
+class MemorySampler:
+    """
+    Muestrea el RSS del proceso y de sus descendientes (Chromium) con app.process_tree_rss.
+    """
+
+    def __init__(self, interval: float = 0.25) -> None:
+        self.interval = interval
+        self.peak_tree_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            tree_rss = app.process_tree_rss([os.getpid()])
+            if tree_rss is not None:
+                self.peak_tree_rss = max(self.peak_tree_rss, tree_rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "MemorySampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_once(report: Path, endpoint: str, concurrency: int, options: dict) -> dict:
+    """
+    Corre process_excel una vez y mide latencia por codigo envolviendo fetch_amount_for_code.
+    """
+    latencies: list[float] = []
+    original_fetch = app.fetch_amount_for_code
+
+    async def timed_fetch(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await original_fetch(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    summary: dict = {}
+    app.fetch_amount_for_code = timed_fetch
+    started = time.perf_counter()
+    try:
+        with MemorySampler() as sampler, contextlib.redirect_stdout(io.StringIO()):
+            await app.process_excel(
+                str(report),
+                cdp_endpoint=endpoint,
+                concurrency=concurrency,
+                use_cache=False,
+                on_summary=summary.update,
+                **options,
+            )
+    finally:
+        app.fetch_amount_for_code = original_fetch
+    elapsed = time.perf_counter() - started
+    rows = summary.get("ml_processed", 0)
+    return {
+        "concurrency": concurrency,
+        "status": summary.get("status", "error"),
+        "ml_rows": summary.get("ml_rows", 0),
+        "ml_processed": rows,
+        "failed_codes": summary.get("failed_codes", 0),
+        "fetches": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "latency_max_ms": round(max(latencies, default=0) * 1000, 1),
+        "latency_mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "peak_tree_rss_mb": round(sampler.peak_tree_rss / 1_000_000, 1),
+        "peak_python_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def verify_output(output: Path, config: FakeDetailConfig) -> int:
+    """
+    Cuenta filas ML cuyo X no coincide con lo que sirvio el servidor (fallos y errores 500).
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(output, read_only=True)
+    mismatches = 0
+    for values in wb["Reporte"].iter_rows(min_row=2, values_only=True):
+        if values[5] != "mercadolibre":
+            continue
+        expected, _ = app.pick_shipping_amount(expected_rows(str(values[7]), config))
+        if values[23] != expected:
+            mismatches += 1
+    wb.close()
+    return mismatches
+
+
+async def run_benchmark(args) -> list[dict]:
+    from playwright.async_api import async_playwright
+
+    config = FakeDetailConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        render_delay_ms=args.render_delay_ms,
+        missing_rate=args.missing_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    server = start_fake_server(config)
+    app.DETAIL_URL_TEMPLATE = f"http://127.0.0.1:{server.server_port}/ventas/{{code}}/detalle"
+    # El servidor falso no tiene listado ni login: sin chequeo de sesion ni corte por timeouts.
+    options = {
+        "engine": args.engine,
+        "block_resources": args.block_resources,
+        "session_check": False,
+        "breaker_threshold": 0,
+    }
+
+    results: list[dict] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "Reporte_bench.xlsx"
+        generate_report(source, args.rows, seed=args.seed)
+        port = app.find_free_port()
+        async with async_playwright() as playwright:
+            browser = await playwright.chromium.launch(
+                headless=True,
+                args=[f"--remote-debugging-port={port}"],
+            )
+            try:
+                if not app.wait_for_port("127.0.0.1", port):
+                    raise RuntimeError("Chromium no abrio el puerto de depuracion")
+                for index, concurrency in enumerate(args.concurrency):
+                    # Copia nueva por corrida: si quedaron codigos sin resolver, process_excel deja
+                    # la bitacora junto al Excel y la siguiente corrida reanudaria en vez de consultar.
+                    run_dir = Path(tmp) / f"run{index}_c{concurrency}"
+                    run_dir.mkdir()
+                    report = run_dir / source.name
+                    shutil.copyfile(source, report)
+                    result = await run_once(report, f"http://127.0.0.1:{port}", concurrency, options)
+                    result["mismatches"] = verify_output(report.with_name(f"{report.stem}_con_envios.xlsx"), config)
+                    results.append(result)
+                    print(
+                        f"[bench] c={concurrency:>2} {result['rows_per_s']:>8} filas/s  "
+                        f"p50={result['latency_p50_ms']}ms p95={result['latency_p95_ms']}ms "
+                        f"max={result['latency_max_ms']}ms  rss={result['peak_tree_rss_mb']}MB  "
+                        f"descuadres={result['mismatches']}",
+                        file=sys.stderr,
+                    )
+            finally:
+                await browser.close()
+    server.shutdown()
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline de process_excel")
+    parser.add_argument("--rows", type=int, default=500, help="Filas del Reporte sintetico")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, app.DEFAULT_CONCURRENCY])
+    parser.add_argument("--latency-ms", type=float, default=120.0)
+    parser.add_argument("--jitter-ms", type=float, default=40.0)
+    parser.add_argument("--render-delay-ms", type=float, default=0.0, help="Retraso del render tipo SPA")
+    parser.add_argument("--missing-rate", type=float, default=0.05, help="Ventas sin Envíos ni Bonificaciones")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraccion de respuestas 500")
+    parser.add_argument("--engine", choices=app.FETCH_ENGINES, default=app.DEFAULT_FETCH_ENGINE)
+    parser.add_argument("--block-resources", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_benchmark(args))
+    print(json.dumps({"rows": args.rows, "engine": args.engine, "runs": results}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
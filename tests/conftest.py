@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# app.py vive en la raiz del repo (no es un paquete instalable).
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+@pytest.fixture
+def fixture_html():
+    def read(name: str) -> str:
+        return (FIXTURES_DIR / name).read_text(encoding="utf-8")
+
+    return read
@@ -0,0 +1,42 @@
+import asyncio
+
+import app
+
+
+class RenderingPage:
+    """
+    Pagina falsa que pinta las filas de a una: cada lectura ve una fila mas.
+    """
+
+    def __init__(self, rows, visible=1):
+        self.rows = rows
+        self.visible = visible
+        self.settle_waits = 0
+
+    async def wait_for_selector(self, selector, state=None, timeout=None):
+        assert selector == app.ACCOUNT_SUBTOTAL_SELECTOR
+
+    async def wait_for_function(self, js, arg=None, polling=None, timeout=None):
+        self.settle_waits += 1
+        self.visible = len(self.rows)
+
+    async def eval_on_selector_all(self, selector, js):
+        return [list(row) for row in self.rows[: self.visible]]
+
+
+def test_waits_for_rows_when_envios_is_missing():
+    page = RenderingPage([("Precio del producto", "$ 9.990"), ("Envíos", "$ 3.090")])
+
+    rows = asyncio.run(app.extract_account_rows(page))
+
+    assert page.settle_waits == 1
+    assert app.pick_shipping_amount(rows) == (3090, "Envíos")
+
+
+def test_reads_once_when_envios_is_present():
+    page = RenderingPage([("Envíos", "$ 3.090"), ("Total", "$ 13.080")], visible=2)
+
+    rows = asyncio.run(app.extract_account_rows(page))
+
+    assert page.settle_waits == 0
+    assert rows == [("Envíos", "$ 3.090"), ("Total", "$ 13.080")]
@@ -0,0 +1,62 @@
+import app
+
+
+def test_detail_rows_from_markup(fixture_html):
+    rows = app.parse_detail_html(fixture_html("detail_envios.html"))
+
+    assert rows == [
+        ("Precio del producto", "$ 24.990"),
+        ("Cargo por venta Incluye el costo fijo por unidad", "-$ 3.499"),
+        ("Envíos", "$ 3.090"),
+        ("Total", "$ 24.581"),
+    ]
+    assert app.pick_shipping_amount(rows) == (3090, "Envíos")
+
+
+def test_unclosed_tag_only_affects_its_row():
+    html = (
+        '<div class="sc-account-rows__row"><div><p>Nota sin cierre</div>'
+        '<div class="sc-account-rows__row__subTotal">$ 100</div></div>'
+        '<div class="sc-account-rows__row"><div>Envíos</div>'
+        '<div class="sc-account-rows__row__subTotal"><span>$ 2.500</span></div></div>'
+    )
+
+    rows = app.parse_detail_html(html)
+
+    assert rows == [("Nota sin cierre", "$ 100"), ("Envíos", "$ 2.500")]
+
+
+def test_detail_falls_back_to_bonificaciones(fixture_html):
+    rows = app.parse_detail_html(fixture_html("detail_bonificaciones.html"))
+
+    assert app.pick_shipping_amount(rows) == (1200, "Bonificaciones")
+
+
+def test_detail_rows_from_preloaded_state(fixture_html):
+    rows = app.parse_detail_html(fixture_html("detail_preloaded_state.html"))
+
+    assert rows == [("Envíos", "-$ 2.950")]
+    # Un cargo de envio (negativo) se reporta como 0, igual que en la pagina.
+    assert app.pick_shipping_amount(rows) == (0, "Envíos")
+
+
+def test_pick_shipping_amount_without_rows():
+    assert app.pick_shipping_amount([("Precio del producto", "$ 9.990")]) == (0, None)
+    assert app.pick_shipping_amount([("Envíos", "sin dato")]) == (None, "Envíos")
+
+
+def test_listing_resolves_requested_codes(fixture_html):
+    codes = {"2000008123456789", "2000008123456790", "2000008123456792", "2000008123456799"}
+
+    found, seen = app.parse_listing_html(fixture_html("listing_preloaded_state.html"), codes)
+
+    assert found == {
+        "2000008123456789": (3090, "Envíos"),
+        "2000008123456790": (1200, "Bonificaciones"),
+    }
+    assert {"2000008123456789", "2000008123456790", "2000008123456792"} <= seen
+    assert "2000008123456799" not in seen
+
+
+def test_listing_without_state():
+    assert app.parse_listing_html("<html><body>Ventas</body></html>", {"1"}) == ({}, set())
@@ -0,0 +1,77 @@
+import re
+import zipfile
+
+from openpyxl import Workbook, load_workbook
+
+import app
+
+
+def build_report(path):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Reporte"
+    ws.append(["Columna"] * 25)
+    rows = [
+        ("mercadolibre", "2000008123456789", 1000, None),
+        ("walmart", "W-1", 2000, 5000),
+        ("MercadoLibre ", "2000008123456789", 1500, None),
+        ("otro", "X-1", 300, None),
+    ]
+    for row_idx, (channel, code, w, y) in enumerate(rows, start=2):
+        ws.cell(row_idx, 6, channel)
+        ws.cell(row_idx, 8, code)
+        ws.cell(row_idx, 23, w)
+        ws.cell(row_idx, 25, y)
+    wb.save(path)
+
+
+def rewrite_dimension(path, ref):
+    # Herramientas que no son Excel suelen dejar un <dimension> que no cubre los datos.
+    source = zipfile.ZipFile(path)
+    items = [(item, source.read(item.filename)) for item in source.infolist()]
+    source.close()
+    with zipfile.ZipFile(path, "w") as target:
+        for item, data in items:
+            if item.filename.startswith("xl/worksheets/"):
+                data = re.sub(rb'<dimension ref="[^"]*"\s*/>', f'<dimension ref="{ref}"/>'.encode(), data)
+            target.writestr(item, data)
+
+
+def test_scan_report_groups_rows(tmp_path):
+    path = tmp_path / "reporte.xlsx"
+    build_report(path)
+
+    scan = app.scan_report(str(path))
+
+    assert (scan.w_col, scan.x_col, scan.y_col) == (23, 24, 25)
+    assert scan.ml_groups == {"2000008123456789": [2, 4]}
+    assert scan.walmart_groups == {"W-1": [3]}
+    assert scan.columns.w[2:5].tolist() == [1000, 2000, 1500]
+    assert scan.columns.y[3] == 5000
+
+
+def test_scan_report_ignores_wrong_dimension(tmp_path):
+    path = tmp_path / "reporte.xlsx"
+    build_report(path)
+    rewrite_dimension(path, "A1")
+
+    scan = app.scan_report(str(path))
+
+    assert scan.x_col == 24
+    assert scan.ml_groups == {"2000008123456789": [2, 4]}
+    assert scan.columns.w[2:5].tolist() == [1000, 2000, 1500]
+
+
+def test_scan_report_treats_out_of_range_amounts_as_zero(tmp_path):
+    path = tmp_path / "reporte.xlsx"
+    build_report(path)
+    wb = load_workbook(path)
+    wb["Reporte"].cell(2, 23, "Ref 2024-05-01 12345678901234567890")
+    wb["Reporte"].cell(3, 25, 10**20)
+    wb.save(path)
+
+    scan = app.scan_report(str(path))
+
+    assert scan.columns.w[2] == 0
+    assert scan.columns.y[3] == 0
+    assert scan.columns.w[4] == 1500
@@ -0,0 +1,53 @@
+import asyncio
+
+import app
+
+
+class FakeResponse:
+    def __init__(self, url, status, body):
+        self.url = url
+        self.status = status
+        self._body = body
+
+    async def text(self):
+        return self._body
+
+    async def dispose(self):
+        pass
+
+
+class FakeRequest:
+    def __init__(self, response):
+        self._response = response
+
+    async def get(self, url, timeout=None):
+        return self._response
+
+
+class FakeContext:
+    def __init__(self, url, status=200, body=""):
+        self.request = FakeRequest(FakeResponse(url, status, body))
+
+
+def probe(url, status=200, body=""):
+    return asyncio.run(app.check_session(FakeContext(url, status, body)))
+
+
+def test_listing_with_recaptcha_widget_is_valid():
+    body = (
+        '<script src="https://www.google.com/recaptcha/api.js"></script>'
+        '<div class="g-recaptcha"></div>'
+        '<script>window.__PRELOADED_STATE__ = {"results": []};</script>'
+    )
+
+    assert probe(app.LISTING_URL, body=body) is None
+
+
+def test_challenge_page_is_captcha():
+    assert probe(app.LISTING_URL, body='<html><div id="px-captcha"></div></html>') == "captcha"
+    assert probe("https://www.mercadolibre.cl/gz/security/captcha?go=ventas") == "captcha"
+
+
+def test_login_redirect_or_forbidden_is_login():
+    assert probe("https://www.mercadolibre.cl/jms/mlc/lgz/login?go=ventas") == "login"
+    assert probe(app.LISTING_URL, status=403) == "login"